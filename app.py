@@ -1,21 +1,167 @@
 import os
+import io
+import sys
+import csv
+import json
+import zlib
+import gzip
+import glob
+import shutil
+import tempfile
+import time
+import uuid
+import queue
+import threading
+import atexit
+import gc
+import copy
+import contextlib
+import contextvars
 import logging
+import logging.handlers
 import sqlite3
 import asyncio
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template_string
+import random
+import hmac
+import hashlib
+import re
+import argparse
+import tracemalloc
+from html.parser import HTMLParser
+from collections import OrderedDict, deque
+from functools import lru_cache, wraps
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import requests
 import httpx
 
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка планировщика между процессами недоступна
+    fcntl = None
+
 # Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+
+# Стандартные атрибуты LogRecord; остальные (extra=...) попадают в JSON как поля
+_LOG_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# Выборка шумных логгеров по умолчанию: доля сохраняемых записей ниже WARNING
+DEFAULT_LOG_SAMPLING = 'safety_bot.keep_alive=0.1,apscheduler.executors.default=0.05'
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Одна JSON-запись на строку: время, уровень, логгер, сообщение и поля extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, pytz.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _LOG_RECORD_FIELDS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, сохраняющий исключение отдельным полем записи.
+
+    Стандартный prepare() форматирует запись целиком: traceback вклеивается
+    в msg, а exc_info обнуляется, и JsonLogFormatter в потоке вывода уже не
+    видит исключения. Здесь в очередь уходит только подставленное сообщение
+    и текст traceback в exc_text - форматирование остается за обработчиком.
+    """
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+        # traceback удерживает кадры стека до записи в поток вывода
+        record.exc_info = None
+        return record
+
+
+class LogSamplingFilter(logging.Filter):
+    """Выборка записей шумных логгеров: spec "логгер=доля,..." (по префиксу имени).
+
+    Сохраняется каждая N-я запись (N = 1/доля); WARNING и выше не отбрасываются.
+    """
+
+    def __init__(self, spec: str):
+        super().__init__()
+        self.rates = {}
+        for item in spec.split(','):
+            name, _, rate = item.partition('=')
+            if name.strip() and rate.strip():
+                self.rates[name.strip()] = float(rate)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name: str):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        return count % round(1 / rate) == 0
+
+
+def setup_logging():
+    """Неблокирующий вывод логов.
+
+    Вызывающий поток только кладет запись в очередь (QueueHandler с выборкой
+    LOG_SAMPLING), форматирование и запись в stderr выполняет поток
+    QueueListener. LOG_FORMAT=json (по умолчанию) или text.
+    """
+    stream_handler = logging.StreamHandler()
+    if os.getenv('LOG_FORMAT', 'json') == 'json':
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(LogSamplingFilter(os.getenv('LOG_SAMPLING', DEFAULT_LOG_SAMPLING)))
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
+keep_alive_logger = logging.getLogger('safety_bot.keep_alive')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'rzd-safety-secret-2024')
@@ -106,6 +252,11 @@ DASHBOARD_HTML = '''
         }
         .status-active { background: #d5f4e6; color: #27ae60; }
         .status-paused { background: #fdebd0; color: #f39c12; }
+        .status-failed { background: #f8d7da; color: #c0392b; }
+
+        .audit-table { width: 100%; border-collapse: collapse; background: white; border-radius: 10px; overflow: hidden; }
+        .audit-table th, .audit-table td { padding: 10px 15px; border-bottom: 1px solid #ecf0f1; text-align: left; }
+        .audit-table th { color: #7f8c8d; font-size: 0.85em; font-weight: 600; }
         
         .alert { 
             padding: 15px; border-radius: 8px; margin: 15px 0;
@@ -150,24 +301,31 @@ DASHBOARD_HTML = '''
             <div class="stat-card {% if bot_status == 'active' %}success{% else %}danger{% endif %}">
                 <div class="stat-label">Статус бота</div>
                 <div class="stat-number">{% if bot_status == 'active' %}✅ Активен{% else %}❌ Ошибка{% endif %}</div>
-                <div class="stat-label">{{ channel_status }}</div>
+                <div class="stat-label" id="channel_status">{{ channel_status }}</div>
             </div>
             
             <div class="stat-card">
                 <div class="stat-label">Запланировано заданий</div>
-                <div class="stat-number">{{ jobs_count }}</div>
+                <div class="stat-number" id="jobs_count">{{ jobs_count }}</div>
                 <div class="stat-label">автоматических</div>
             </div>
             
             <div class="stat-card">
                 <div class="stat-label">Отправлено сообщений</div>
-                <div class="stat-number">{{ posts_sent }}</div>
+                <div class="stat-number" id="posts_sent">{{ posts_sent }}</div>
                 <div class="stat-label">всего</div>
             </div>
             
+            <div class="stat-card {% if breaker_state == 'open' %}danger{% elif breaker_state == 'half_open' %}warning{% else %}success{% endif %}" id="breaker_card">
+                <div class="stat-label">Telegram API</div>
+                <div class="stat-number" id="breaker_state" style="font-size: 1.6em;">{{ breaker_state or 'closed' }}</div>
+                <div class="stat-label">срабатываний: <span id="breaker_trips">{{ breaker_trips or 0 }}</span>,
+                    в очереди: <span id="outbound_pending">{{ outbound_pending or 0 }}</span></div>
+            </div>
+            
             <div class="stat-card">
                 <div class="stat-label">Текущий день</div>
-                <div class="stat-number" style="font-size: 2em;">{{ current_day }}</div>
+                <div class="stat-number" id="current_day" style="font-size: 2em;">{{ current_day }}</div>
                 <div class="stat-label">из 30 рабочих дней</div>
             </div>
         </div>
@@ -179,7 +337,7 @@ DASHBOARD_HTML = '''
             
             <div class="content-info">
                 <strong>📅 Информация о контенте:</strong> Система автоматически ротирует контент по 30-дневному циклу. 
-                Сегодня показывается контент для дня <strong>{{ current_day }}</strong>.
+                Сегодня показывается контент для дня <strong id="content_day_info">{{ current_day }}</strong>.
             </div>
             
             <div class="section">
@@ -190,16 +348,16 @@ DASHBOARD_HTML = '''
                         <a href="/stop-scheduler" class="btn btn-warning">⏸️ Остановить авто-постинг</a>
                         <a href="/send-daily" class="btn btn-primary">📨 Отправить все посты дня</a>
                         <a href="/test-all-content" class="btn btn-primary">🧪 Тест всех типов контента</a>
-                        <a href="/next-day" class="btn btn-warning">⏭️ Следующий день</a>
+                        <a href="/next-day?from={{ current_day }}" class="btn btn-warning">⏭️ Следующий день</a>
                     </div>
                 </div>
                 
                 <div class="jobs-list">
                     {% for job in scheduled_jobs %}
-                    <div class="job-item">
+                    <div class="job-item" data-job-id="{{ job.id }}">
                         <div class="job-info">
                             <div class="job-name">{{ job.name }}</div>
-                            <div class="job-time">Следующий запуск: {{ job.next_run }}</div>
+                            <div class="job-time">Следующий запуск: <span class="job-next-run">{{ job.next_run }}</span></div>
                         </div>
                         <div class="job-status {% if job.next_run != 'N/A' %}status-active{% else %}status-paused{% endif %}">
                             {% if job.next_run != 'N/A' %}Активно{% else %}Остановлено{% endif %}
@@ -241,6 +399,15 @@ DASHBOARD_HTML = '''
                         <div class="form-group" id="custom_text_group" style="display: none;">
                             <label for="custom_text">Произвольный текст:</label>
                             <textarea id="custom_text" name="custom_text" placeholder="Введите текст сообщения..."></textarea>
+                            <label for="send_at">Отправить позже (время Кемерово, необязательно):</label>
+                            <input type="datetime-local" id="send_at" name="send_at">
+                            <label for="recurrence">Повтор:</label>
+                            <select id="recurrence" name="recurrence">
+                                <option value="">Без повтора</option>
+                                <option value="daily">Ежедневно</option>
+                                <option value="weekly">Еженедельно</option>
+                            </select>
+                            <label><input type="checkbox" name="urgent" value="1"> 🚨 Срочно: вне очереди рассылок</label>
                         </div>
                         
                         <button type="submit" class="success">📨 Отправить в канал</button>
@@ -255,11 +422,37 @@ DASHBOARD_HTML = '''
                 </div>
             </div>
             
+            <div class="section">
+                <h2 class="section-title">📡 Каналы</h2>
+                <div class="btn-group">
+                    <a href="/audit-channels" class="btn btn-primary">🔍 Проверить все каналы</a>
+                </div>
+                {% if channel_audit %}
+                <table class="audit-table">
+                    <tr><th>Канал</th><th>Название</th><th>Статус бота</th><th>Публикация</th><th>Исправление</th><th>Проверен (UTC)</th><th></th></tr>
+                    {% for row in channel_audit %}
+                    <tr>
+                        <td>{{ row.channel }}</td>
+                        <td>{{ row.title or '—' }}</td>
+                        <td>{{ row.member_status or '—' }}</td>
+                        <td>{% if row.can_post %}✅{% else %}❌{% endif %}</td>
+                        <td>{% if row.can_edit and row.can_delete %}✅{% else %}❌{% endif %}</td>
+                        <td>{{ row.checked_at[:16].replace('T', ' ') }}</td>
+                        <td><span class="job-status {% if row.status == 'ok' %}status-active{% elif row.status == 'warn' %}status-paused{% else %}status-failed{% endif %}"
+                                  title="{{ row.error or '' }}">{{ row.status }}</span></td>
+                    </tr>
+                    {% endfor %}
+                </table>
+                {% else %}
+                <p>Каналы еще не проверялись.</p>
+                {% endif %}
+            </div>
+
             <div class="section">
                 <h2 class="section-title">📋 Последние логи</h2>
-                <div class="logs">
+                <div class="logs" id="logs">
                     {% for log in recent_logs %}
-                    <div class="log-entry">{{ log.timestamp }} - {{ log.message }}</div>
+                    <div class="log-entry" data-log-id="{{ log.id }}">{{ log.timestamp }} - {{ log.message }}</div>
                     {% endfor %}
                 </div>
             </div>
@@ -272,115 +465,1541 @@ DASHBOARD_HTML = '''
             customGroup.style.display = this.value === 'custom' ? 'block' : 'none';
         });
         
-        // Авто-обновление каждые 30 секунд
-        setTimeout(() => { location.reload(); }, 30000);
+        // Живые обновления через Server-Sent Events (без перезагрузки страницы)
+        if (window.EventSource) {
+            const events = new EventSource('/events');
+            const setText = (id, value) => {
+                const el = document.getElementById(id);
+                if (el) el.textContent = value;
+            };
+
+            events.addEventListener('stats', (e) => {
+                const data = JSON.parse(e.data);
+                if ('posts_sent' in data) setText('posts_sent', data.posts_sent);
+                if ('channel_status' in data) setText('channel_status', data.channel_status);
+                if ('breaker_trips' in data) setText('breaker_trips', data.breaker_trips);
+                if ('outbound_pending' in data) setText('outbound_pending', data.outbound_pending);
+                if ('breaker_state' in data) {
+                    setText('breaker_state', data.breaker_state);
+                    const card = document.getElementById('breaker_card');
+                    card.className = 'stat-card ' + ({open: 'danger', half_open: 'warning'}[data.breaker_state] || 'success');
+                }
+            });
+
+            events.addEventListener('day', (e) => {
+                const data = JSON.parse(e.data);
+                setText('current_day', data.current_day);
+                setText('content_day_info', data.current_day);
+            });
+
+            events.addEventListener('jobs', (e) => {
+                const jobs = JSON.parse(e.data).jobs;
+                setText('jobs_count', jobs.length);
+                jobs.forEach((job) => {
+                    const item = document.querySelector(`.job-item[data-job-id="${job.id}"]`);
+                    if (!item) return;
+                    item.querySelector('.job-next-run').textContent = job.next_run;
+                    const status = item.querySelector('.job-status');
+                    const active = job.next_run !== 'N/A';
+                    status.className = 'job-status ' + (active ? 'status-active' : 'status-paused');
+                    status.textContent = active ? 'Активно' : 'Остановлено';
+                });
+            });
+
+            events.addEventListener('logs', (e) => {
+                const container = document.getElementById('logs');
+                JSON.parse(e.data).logs.forEach((log) => {
+                    if (container.querySelector(`[data-log-id="${log.id}"]`)) return;
+                    const entry = document.createElement('div');
+                    entry.className = 'log-entry';
+                    entry.dataset.logId = log.id;
+                    entry.textContent = `${log.timestamp} - ${log.message}`;
+                    container.prepend(entry);
+                });
+                while (container.children.length > 10) container.lastElementChild.remove();
+            });
+        } else {
+            // Старые браузеры: полное обновление каждые 30 секунд
+            setTimeout(() => { location.reload(); }, 30000);
+        }
     </script>
 </body>
 </html>
 '''
 
+def _rotation_shuffle(channel: str, post_type: str, size: int, epoch: int):
+    """Исходная перестановка прохода до поправки на стык с предыдущим"""
+    seed = hashlib.sha256(f"{channel}|{post_type}|{size}|{epoch}".encode('utf-8')).digest()
+    order = list(range(size))
+    random.Random(seed).shuffle(order)
+    return order
+
+
+@lru_cache(maxsize=4096)
+def _rotation_permutation(channel: str, post_type: str, size: int, epoch: int):
+    """Перестановка номеров пула для одного прохода (epoch) канала.
+
+    Детерминирована по (канал, тип, размер пула, проход), поэтому ее не нужно
+    хранить: любой процесс вычислит ту же самую. Первый элемент прохода не
+    совпадает с последним элементом предыдущего. Поправка меняет местами
+    только элементы 0 и 1, поэтому последний элемент прохода берется из его
+    исходной перестановки - без рекурсии по всем прошлым проходам.
+    """
+    order = _rotation_shuffle(channel, post_type, size, epoch)
+    if epoch > 0 and size > 2 and order[0] == _rotation_shuffle(channel, post_type, size, epoch - 1)[-1]:
+        order[0], order[1] = order[1], order[0]
+    return tuple(order)
+
+
+def rotation_pick(channel: str, post_type: str, size: int, sequence: int):
+    """Позиция в пуле для sequence-го показа: без повторов, пока пул не исчерпан"""
+    epoch, position = divmod(sequence, size)
+    return _rotation_permutation(channel or '', post_type, size, epoch)[position]
+
+
+# Текущий спан трассировки (наследуется вложенными вызовами и задачами asyncio)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Tracer:
+    """Легковесная трассировка публикаций с экспортом в файл.
+
+    Спаны пишутся по одному на строку в формате Zipkin v2 JSON (загружается
+    в Zipkin/Jaeger) через очередь и отдельный поток, с ротацией файла.
+    Каждый процесс пишет в свой файл (traces.<pid>.ndjson): ротация в одном
+    воркере gunicorn не затирает файл другого.
+    Родительский спан передается через contextvars; дочерние спаны (root=False)
+    вне трассы не создаются, поэтому частые вызовы вроде предпросмотра
+    расписания не засоряют файл.
+    """
+
+    def __init__(self, path: str, service_name: str = 'rzd-safety-bot', max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 3):
+        self.path = path
+        self.service_name = service_name
+        self.backup_count = backup_count
+        self.enabled = bool(path)
+        if not self.enabled:
+            return
+        root, ext = os.path.splitext(path)
+        self.process_path = f"{root}.{os.getpid()}{ext}"
+        file_handler = logging.handlers.RotatingFileHandler(self.process_path, maxBytes=max_bytes,
+                                                            backupCount=backup_count, encoding='utf-8', delay=True)
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        # Записи кладутся в очередь напрямую, минуя уровни и фильтры логгеров
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, file_handler)
+        self._listener.start()
+        atexit.register(self._listener.stop)
+
+    @contextlib.contextmanager
+    def span(self, name: str, root: bool = True, **tags):
+        """Спан вокруг блока кода; root=False - только внутри уже начатой трассы"""
+        parent = _current_span.get()
+        if not self.enabled or (parent is None and not root):
+            yield None
+            return
+        span = {
+            'traceId': parent['traceId'] if parent else uuid.uuid4().hex,
+            'id': os.urandom(8).hex(),
+            'parentId': parent['id'] if parent else None,
+            'name': name,
+            'tags': {key: str(value) for key, value in tags.items() if value is not None}
+        }
+        token = _current_span.set(span)
+        timestamp = time.time()
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span['tags']['error'] = str(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._export(span, timestamp, time.perf_counter() - started)
+
+    def _export(self, span: dict, timestamp: float, duration: float):
+        record = {
+            'traceId': span['traceId'],
+            'id': span['id'],
+            'name': span['name'],
+            'timestamp': int(timestamp * 1_000_000),
+            'duration': max(1, int(duration * 1_000_000)),
+            'localEndpoint': {'serviceName': self.service_name},
+            'tags': span['tags']
+        }
+        if span['parentId']:
+            record['parentId'] = span['parentId']
+        self._queue.put_nowait(logging.makeLogRecord({'msg': json.dumps(record, ensure_ascii=False)}))
+
+    def _export_files(self):
+        """Файлы экспорта всех процессов, включая ротированные (до backup_count)"""
+        root, ext = os.path.splitext(self.path)
+        pattern = re.compile(rf"{re.escape(root)}\.\d+{re.escape(ext)}(\.(\d+))?")
+        paths = []
+        for path in glob.glob(f"{glob.escape(root)}.*{ext}*"):
+            match = pattern.fullmatch(path)
+            if match and (not match.group(2) or 1 <= int(match.group(2)) <= self.backup_count):
+                paths.append(path)
+        return paths
+
+    def find(self, trace_id: str):
+        """Спаны трассы из файлов экспорта (всех процессов, включая ротированные), по времени начала"""
+        spans = []
+        if not self.enabled:
+            return spans
+        for path in self._export_files():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(span, dict) and span.get('traceId') == trace_id:
+                        spans.append(span)
+        return sorted(spans, key=lambda item: item['timestamp'])
+
+
+def current_trace_id():
+    """Идентификатор текущей трассы (None вне трассы)"""
+    span = _current_span.get()
+    return span['traceId'] if span else None
+
+
+def set_span_tag(key: str, value):
+    """Добавить тег к текущему спану"""
+    span = _current_span.get()
+    if span is not None and value is not None:
+        span['tags'][key] = str(value)
+
+
+def traced(name: str = None, root: bool = False):
+    """Декоратор: спан вокруг вызова функции или корутины (root=True - может начать трассу)"""
+    def decorate(func):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name, root=root):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name, root=root):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+tracer = Tracer(os.getenv('TRACE_FILE', 'traces.ndjson'))
+
+
+class RateLimiter:
+    """Ограничитель частоты отправки: не чаще одного вызова в interval секунд.
+
+    Общий для всех потоков: каждый вызывающий резервирует следующий слот
+    под блокировкой и ждет его без удержания блокировки.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    def backlog(self):
+        """Сколько секунд уже зарезервировано вперед (очередь на отправку)"""
+        with self._lock:
+            return max(0.0, self._next_slot - time.monotonic())
+
+    def wait(self):
+        """Блокирующее ожидание слота (для потоков)"""
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """Ожидание слота без блокировки event loop"""
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Полоса приоритета текущей отправки (задается на входе: планировщик, задание, ручная отправка)
+_delivery_lane = contextvars.ContextVar('delivery_lane', default='manual')
+
+
+@contextlib.contextmanager
+def delivery_lane(lane: str):
+    """Выполнение блока в полосе приоритета lane (см. PriorityRateLimiter.LANES)"""
+    token = _delivery_lane.set(lane)
+    try:
+        yield
+    finally:
+        _delivery_lane.reset(token)
+
+
+class PriorityRateLimiter:
+    """Общий лимит вызовов Bot API с полосами приоритета.
+
+    Вызов ждет слот в очереди своей полосы (_delivery_lane). emergency
+    вытесняет остальных: ее ожидающие получают ближайший слот вне общей
+    очереди, поэтому срочный пост ждет не дольше interval на каждый
+    срочный вызов впереди, даже во время большой рассылки. Остальные
+    полосы делят слоты по весам (плавный взвешенный round-robin), так что
+    bulk не останавливается полностью под плановым потоком.
+    """
+
+    LANES = ('emergency', 'manual', 'scheduled', 'bulk')
+    DEFAULT_WEIGHTS = 'manual=4,scheduled=2,bulk=1'
+
+    def __init__(self, interval: float, weights: str = DEFAULT_WEIGHTS):
+        self.interval = interval
+        self.weights = {lane: 1 for lane in self.LANES[1:]}
+        for part in filter(None, (item.strip() for item in weights.split(','))):
+            lane, _, weight = part.partition('=')
+            if lane.strip() in self.weights:
+                self.weights[lane.strip()] = max(int(weight), 1)
+        self._lock = threading.Lock()
+        self._queues = {lane: deque() for lane in self.LANES}
+        self._credit = {lane: 0 for lane in self.LANES}
+        self._next_slot = 0.0
+        self._timer = None
+        self.granted = {lane: 0 for lane in self.LANES}
+        self.max_wait = {lane: 0.0 for lane in self.LANES}
+
+    async def wait_async(self):
+        """Ожидание слота в полосе текущего контекста без блокировки event loop"""
+        lane = _delivery_lane.get()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_slot and not any(self._queues.values()):
+                self._grant(lane, now, now)
+                return
+            future = loop.create_future()
+            self._queues[lane].append((future, now))
+            if self._timer is None:
+                self._timer = loop.call_later(max(self._next_slot - now, 0), self._release)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future.cancelled():
+                    self._queues[lane] = deque(item for item in self._queues[lane] if item[0] is not future)
+            raise
+
+    def _grant(self, lane: str, queued_at: float, now: float):
+        self._next_slot = max(now, self._next_slot) + self.interval
+        self.granted[lane] += 1
+        self.max_wait[lane] = max(self.max_wait[lane], now - queued_at)
+
+    def _pick_lane(self):
+        """Полоса следующего слота: emergency вне очереди, остальные - по весам"""
+        if self._queues['emergency']:
+            return 'emergency'
+        waiting = [lane for lane in self.LANES[1:] if self._queues[lane]]
+        if not waiting:
+            return None
+        for lane in waiting:
+            self._credit[lane] += self.weights[lane]
+        lane = max(waiting, key=lambda candidate: self._credit[candidate])
+        self._credit[lane] -= sum(self.weights[candidate] for candidate in waiting)
+        return lane
+
+    def _release(self):
+        """Выдача слота одному ожидающему (вызывается таймером в цикле событий)"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._timer = None
+            now = time.monotonic()
+            while True:
+                lane = self._pick_lane()
+                if lane is None:
+                    return
+                future, queued_at = self._queues[lane].popleft()
+                if not future.done():
+                    break
+            self._grant(lane, queued_at, now)
+            future.set_result(None)
+            if any(self._queues.values()):
+                self._timer = loop.call_later(max(self._next_slot - now, 0), self._release)
+
+    def backlog(self):
+        """Сколько секунд нужно, чтобы обслужить всех ожидающих"""
+        with self._lock:
+            waiting = sum(len(queue) for queue in self._queues.values())
+            return max(0.0, self._next_slot - time.monotonic()) + waiting * self.interval
+
+    def snapshot(self):
+        with self._lock:
+            return {lane: {
+                'waiting': len(self._queues[lane]),
+                'granted': self.granted[lane],
+                'max_wait_ms': round(self.max_wait[lane] * 1000, 1),
+                'weight': self.weights.get(lane)
+            } for lane in self.LANES}
+
+
+class AsyncRuntime:
+    """Общий цикл событий процесса в отдельном потоке и общий HTTP-клиент.
+
+    Синхронный код (маршруты Flask, задания планировщика) передает корутины
+    в run(): ожидание ответа Telegram не создает свой цикл событий и свое
+    соединение, запросы всех потоков мультиплексируются в одном цикле.
+    Задержка цикла (насколько позже срока срабатывает таймер каждые
+    LAG_INTERVAL секунд) показывает, блокирует ли что-то цикл.
+    """
+
+    LAG_INTERVAL = 0.05
+    # Окно замеров задержки: около минуты
+    LAG_WINDOW = 1200
+
+    def __init__(self, max_connections: int = 100):
+        self.loop = asyncio.new_event_loop()
+        self.max_connections = max_connections
+        self._client = None
+        self._lag_lock = threading.Lock()
+        self._lag_samples = deque(maxlen=self.LAG_WINDOW)
+        self.lag_max = 0.0
+        self._thread = threading.Thread(target=self.loop.run_forever, name='async-runtime', daemon=True)
+        self._thread.start()
+        self.loop.call_soon_threadsafe(self._schedule_lag_probe)
+
+    def _schedule_lag_probe(self):
+        deadline = self.loop.time() + self.LAG_INTERVAL
+        self.loop.call_at(deadline, self._lag_probe, deadline)
+
+    def _lag_probe(self, deadline: float):
+        lag = max(self.loop.time() - deadline, 0.0)
+        with self._lag_lock:
+            self._lag_samples.append(lag)
+            self.lag_max = max(self.lag_max, lag)
+        self._schedule_lag_probe()
+
+    def lag_snapshot(self):
+        """Задержка цикла событий за последнее окно замеров (мс)"""
+        with self._lag_lock:
+            samples = sorted(self._lag_samples)
+            lag_max = self.lag_max
+        if not samples:
+            return {'samples': 0}
+
+        def percentile(share):
+            return round(samples[min(int(len(samples) * share), len(samples) - 1)] * 1000, 2)
+
+        return {
+            'samples': len(samples),
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            'window_max_ms': round(samples[-1] * 1000, 2),
+            'max_ms': round(lag_max * 1000, 2)
+        }
+
+    @property
+    def client(self):
+        """HTTP-клиент с пулом соединений (только для корутин в этом цикле)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=min(self.max_connections, 20)
+            ))
+        return self._client
+
+    def in_loop(self):
+        """Выполняется ли текущий код внутри общего цикла"""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def submit(self, coro):
+        """Запуск корутины в общем цикле; возвращает concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Выполнение корутины в общем цикле с ожиданием результата"""
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("AsyncRuntime.run() нельзя вызывать из общего цикла")
+        return self.submit(coro).result(timeout)
+
+
+class SQLiteWriter:
+    """Поток-писатель SQLite для корутин общего цикла.
+
+    Запрос - функция func(conn, *args), она выполняется в отдельном потоке
+    на одном долгоживущем соединении. Запросы, накопившиеся в очереди,
+    коммитятся одной транзакцией (каждый в своем SAVEPOINT: ошибка одного
+    не откатывает остальные), поэтому при рассылке по многим каналам запись
+    журнала стоит одного fsync на пачку. Функции не вызывают commit сами.
+    """
+
+    MAX_BATCH = 64
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.commits = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.max_batch_seen = 0
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """Постановка запроса в очередь; возвращает concurrent.futures.Future"""
+        future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    async def run(self, func, *args):
+        """Выполнение запроса с ожиданием результата без блокировки цикла событий"""
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            outcomes = self._execute(conn, [item for item in batch if item[2].set_running_or_notify_cancel()])
+            with self._lock:
+                self.requests += len(batch)
+                self.commits += 1
+                self.failures += sum(1 for _, _, error in outcomes if error is not None)
+                self.busy_seconds += time.perf_counter() - started
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            for future, result, error in outcomes:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def _execute(self, conn, batch):
+        """Выполнение пачки запросов в одной транзакции: [(future, результат, ошибка)]"""
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for func, args, future in batch:
+                conn.execute('SAVEPOINT request')
+                try:
+                    outcomes.append((future, func(conn, *args), None))
+                    conn.execute('RELEASE request')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO request')
+                    conn.execute('RELEASE request')
+                    outcomes.append((future, None, e))
+            conn.execute('COMMIT')
+            return outcomes
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error(f"Ошибка транзакции потока-писателя SQLite: {e}")
+            return [(future, None, e) for _, _, future in batch]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'requests': self.requests,
+                'commits': self.commits,
+                'failures': self.failures,
+                'busy_ms': round(self.busy_seconds * 1000, 1),
+                'max_batch': self.max_batch_seen
+            }
+
+
+class PostingJobManager:
+    """Фоновые задания массовой отправки с отчетом о ходе выполнения"""
+
+    MAX_FINISHED_JOBS = 50
+
+    def __init__(self, rate_limiter: RateLimiter, runtime: AsyncRuntime):
+        self.rate_limiter = rate_limiter
+        self.runtime = runtime
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, worker, items, name: str, concurrency: int = 1, rate_limiter: RateLimiter = None,
+              lane: str = 'bulk'):
+        """Запуск задания в общем цикле событий (без отдельного потока).
+
+        worker - корутина worker(item), возвращающая (успех, текст результата); исключение -
+        тоже неуспех;
+        items - список словарей с параметрами (например, post_type и day);
+        concurrency - сколько элементов обрабатывается одновременно;
+        rate_limiter - темп вызовов (по умолчанию темп ручных отправок);
+        lane - полоса приоритета вызовов Bot API (массовые задания - bulk).
+        Возвращает идентификатор задания.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'id': job_id,
+            'name': name,
+            'status': 'queued',
+            'lane': lane,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'posts': [dict(
+                item,
+                status='pending',
+                started_at=None,
+                duration_ms=None,
+                result=None
+            ) for item in items]
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict_finished()
+
+        future = self.runtime.submit(self._run_async(job, worker, concurrency, rate_limiter or self.rate_limiter))
+        future.add_done_callback(lambda done: self._on_done(job, done))
+        return job_id
+
+    def _on_done(self, job, future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Задание {job['id']} завершилось с ошибкой: {error}")
+            job['status'] = 'failed'
+            job['finished_at'] = datetime.now().isoformat()
+
+    async def _run_async(self, job, worker, concurrency, rate_limiter):
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_item(post):
+            async with semaphore:
+                await rate_limiter.wait_async()
+                post['status'] = 'sending'
+                post['started_at'] = datetime.now().isoformat()
+                started = time.monotonic()
+                try:
+                    success, result = await worker(post)
+                    post['status'] = 'sent' if success else 'failed'
+                except Exception as e:
+                    result = f"❌ Ошибка: {e}"
+                    post['status'] = 'failed'
+                post['result'] = result
+                post['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+        with delivery_lane(job['lane']):
+            await asyncio.gather(*(run_item(post) for post in job['posts']))
+
+        failed = sum(1 for post in job['posts'] if post['status'] == 'failed')
+        job['status'] = 'completed' if not failed else 'completed_with_errors'
+        job['finished_at'] = datetime.now().isoformat()
+        logger.info(f"Задание {job['id']} ({job['name']}) завершено, ошибок: {failed}")
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['finished_at']]
+        for job_id in finished[:max(0, len(finished) - self.MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str):
+        """Снимок состояния задания или None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job, posts=[dict(post) for post in job['posts']])
+        snapshot['progress'] = {
+            'total': len(snapshot['posts']),
+            'done': sum(1 for post in snapshot['posts'] if post['status'] in ('sent', 'failed'))
+        }
+        return snapshot
+
+    def pending_posts(self):
+        """Число постов, ожидающих отправки во всех заданиях"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sum(1 for job in jobs for post in job['posts'] if post['status'] in ('pending', 'sending'))
+
+    def list(self):
+        """Краткий список заданий (новые первыми)"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [{
+            'id': job['id'],
+            'name': job['name'],
+            'status': job['status'],
+            'created_at': job['created_at']
+        } for job in reversed(jobs)]
+
+
+class DashboardEventBroadcaster:
+    """Рассылка изменений дашборда по Server-Sent Events.
+
+    Состояние опрашивает один фоновый поток (и только пока есть подписчики),
+    поэтому нагрузка на БД не зависит от числа открытых вкладок. Подписчикам
+    уходят только изменившиеся части состояния.
+
+    Каждый открытый поток занимает рабочий поток gunicorn на все время
+    соединения, поэтому число подписчиков ограничено max_clients: сверх
+    лимита subscribe() возвращает None, а остальные запросы продолжают
+    обслуживаться.
+    """
+
+    QUEUE_SIZE = 100
+    HEARTBEAT_SECONDS = 15
+
+    def __init__(self, state_fn, interval: float, max_clients: int):
+        self.state_fn = state_fn
+        self.interval = interval
+        self.max_clients = max_clients
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._state = None
+        self._thread = None
+
+    def subscribe(self):
+        """Новая очередь подписчика или None, если лимит клиентов исчерпан"""
+        subscriber = queue.Queue(maxsize=self.QUEUE_SIZE)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            self._subscribers.add(subscriber)
+            # Новый подписчик сразу получает последнее известное состояние целиком
+            for event, data in self._diff(None, self._state):
+                subscriber.put_nowait((event, data))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, name='dashboard-events', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream(self, subscriber):
+        """Генератор тела ответа text/event-stream для одного клиента"""
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=self.HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def _poll_loop(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    self._state = None
+                    return
+            try:
+                state = self.state_fn()
+                for event, data in self._diff(self._state, state):
+                    self._publish(event, data)
+                self._state = state
+            except Exception as e:
+                logger.error(f"Error polling dashboard state: {e}")
+            time.sleep(self.interval)
+
+    def _publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # Медленный клиент: теряем самое старое событие, а не блокируем рассылку
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait((event, data))
+                except (queue.Empty, queue.Full):
+                    pass
+
+    @staticmethod
+    def _diff(old, new):
+        """События (имя, данные) для перехода от состояния old к new"""
+        if new is None:
+            return []
+        old = old or {}
+        events = []
+
+        stats = {key: new[key] for key in ('posts_sent', 'channel_status', 'breaker_state',
+                                           'breaker_trips', 'outbound_pending')
+                 if old.get(key) != new[key]}
+        if stats:
+            events.append(('stats', stats))
+        if old.get('current_day') != new['current_day']:
+            events.append(('day', {'current_day': new['current_day']}))
+        if old.get('jobs') != new['jobs']:
+            events.append(('jobs', {'jobs': new['jobs']}))
+
+        last_log_id = max((log['id'] for log in old.get('logs', [])), default=0)
+        new_logs = [log for log in reversed(new['logs']) if log['id'] > last_log_id]
+        if new_logs:
+            events.append(('logs', {'logs': new_logs}))
+        return events
+
+
+class HealthProber:
+    """Фоновые проверки компонентов с кешированием результатов.
+
+    Каждая проверка - функция без аргументов, возвращающая (status, detail),
+    где status: 'ok', 'warn' или 'fail'. Исключение считается статусом 'fail'.
+    Эндпоинты /health и /ready читают только кеш.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._probes = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, name: str, probe, critical: bool = True):
+        self._probes[name] = (probe, critical)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='health-prober', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        """Выполнить все проверки и обновить кеш"""
+        for name, (probe, critical) in self._probes.items():
+            started = time.monotonic()
+            try:
+                status, detail = probe()
+            except Exception as e:
+                status, detail = 'fail', str(e)
+            result = {
+                'status': status,
+                'detail': detail,
+                'critical': critical,
+                'latency_ms': round((time.monotonic() - started) * 1000, 1),
+                'checked_at': datetime.now().isoformat()
+            }
+            with self._lock:
+                self._results[name] = result
+
+    def snapshot(self):
+        """Кешированные результаты и сводный статус"""
+        with self._lock:
+            components = dict(self._results)
+        if not components:
+            overall = 'unknown'
+        elif any(c['status'] == 'fail' and c['critical'] for c in components.values()):
+            overall = 'unhealthy'
+        elif any(c['status'] != 'ok' for c in components.values()):
+            overall = 'degraded'
+        else:
+            overall = 'healthy'
+        stale_after = 3 * self.interval
+        checked = [datetime.fromisoformat(c['checked_at']) for c in components.values()]
+        stale = bool(checked) and (datetime.now() - min(checked)).total_seconds() > stale_after
+        return {
+            'status': overall,
+            'stale': stale,
+            'components': components
+        }
+
+
+class CircuitBreaker:
+    """Автомат защиты для внешнего API (closed -> open -> half_open).
+
+    После failure_threshold сбоев подряд вызовы отклоняются сразу в течение
+    reset_timeout секунд, затем пропускается один пробный вызов: успех
+    замыкает цепь, сбой снова размыкает ее.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = 'half_open'
+            self._trial_in_flight = False
+        return self._state
+
+    def is_open(self):
+        return self.state == 'open'
+
+    def allow(self):
+        """Можно ли выполнять вызов сейчас"""
+        with self._lock:
+            state = self._current_state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.last_error = error
+            self._failures += 1
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self.trips += 1
+                    logger.warning(f"Circuit breaker разомкнут: {error}")
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'last_error': self.last_error
+            }
+
+
+class SettingsCache:
+    """Кэш system_settings в памяти процесса.
+
+    Значения перечитываются, только когда БД изменил кто-то еще: у отдельного
+    долгоживущего соединения сверяется PRAGMA data_version, которое SQLite
+    увеличивает при каждом коммите из другого соединения или процесса
+    (в том числе из соседних воркеров gunicorn). Пока версия не изменилась,
+    чтение - поиск в словаре.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._version = None
+        self._values = {}
+        self.hits = 0
+        self.reloads = 0
+
+    def _current_version(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def get(self, key: str):
+        """Значение ключа (строка) или None, если его нет"""
+        with self._lock:
+            version = self._current_version()
+            if version != self._version:
+                self._values = dict(self._conn.execute('SELECT key, value FROM system_settings'))
+                self._version = version
+                self.reloads += 1
+            else:
+                self.hits += 1
+            return self._values.get(key)
+
+    def invalidate(self):
+        """Сбросить кэш (после записи через это же соединение или смены файла БД)"""
+        with self._lock:
+            self._version = None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._version = None
+
+    def snapshot(self):
+        with self._lock:
+            return {'version': self._version, 'keys': len(self._values),
+                    'hits': self.hits, 'reloads': self.reloads}
+
+
+class ContentStore:
+    """Компактное хранилище текстов контента.
+
+    Тексты интернируются по хешу (одинаковые записи разных вариантов депо
+    хранятся один раз) и сжимаются zlib с общим словарем из повторяющихся
+    строк корпуса: заголовков, HTML-разметки, подписей. Распакованные тексты
+    держатся в небольшом LRU. Тексты с compress=False хранятся как есть.
+    """
+
+    # Размер окна zlib - больший словарь не используется
+    ZDICT_LIMIT = 32 * 1024
+
+    def __init__(self, corpus, cache_size: int = 64, level: int = 9):
+        self.zdict = self.build_dictionary(corpus)
+        self.level = level
+        self.cache_size = cache_size
+        self._entries = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'refs': 0, 'hits': 0, 'misses': 0}
+        self._raw_bytes = 0
+
+    @classmethod
+    def build_dictionary(cls, corpus):
+        """Общий словарь: строки и их префиксы до первой цифры, повторяющиеся в корпусе"""
+        counts = {}
+        for text in corpus:
+            candidates = set()
+            for line in text.split('\n'):
+                candidates.add(line)
+                candidates.add(re.split(r'\d', line, maxsplit=1)[0])
+            for candidate in candidates:
+                if len(candidate) >= 4:
+                    counts[candidate] = counts.get(candidate, 0) + 1
+        ranked = sorted((candidate for candidate, count in counts.items() if count > 1),
+                        key=lambda candidate: counts[candidate] * len(candidate.encode('utf-8')), reverse=True)
+        parts, size = [], 0
+        for candidate in ranked:
+            data = (candidate + '\n').encode('utf-8')
+            if size + len(data) > cls.ZDICT_LIMIT:
+                continue
+            parts.append(data)
+            size += len(data)
+        # Совпадения ближе к концу словаря кодируются короче - самые частые строки в конец
+        return b''.join(reversed(parts))
+
+    def put(self, text: str, compress: bool = True):
+        """Сохранить текст; возвращает ссылку (хеш) для get()"""
+        ref = hashlib.blake2b(text.encode('utf-8'), digest_size=12).digest()
+        with self._lock:
+            self.counters['refs'] += 1
+            if ref not in self._entries:
+                self._raw_bytes += sys.getsizeof(text)
+                self._entries[ref] = self._compress(text) if compress else text
+        return ref
+
+    def get(self, ref: bytes):
+        """Текст по ссылке (распаковка через LRU)"""
+        entry = self._entries[ref]
+        if isinstance(entry, str):
+            return entry
+        with self._lock:
+            text = self._cache.get(ref)
+            if text is not None:
+                self._cache.move_to_end(ref)
+                self.counters['hits'] += 1
+                return text
+            self.counters['misses'] += 1
+        decompressor = zlib.decompressobj(-15, zdict=self.zdict)
+        text = (decompressor.decompress(entry) + decompressor.flush()).decode('utf-8')
+        with self._lock:
+            self._cache[ref] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    def _compress(self, text: str):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict=self.zdict)
+        return compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+    def stats(self):
+        """Размеры: исходные тексты против сжатых записей и словаря"""
+        with self._lock:
+            compressed = [entry for entry in self._entries.values() if isinstance(entry, bytes)]
+            stored = sum(sys.getsizeof(entry) for entry in compressed) + sys.getsizeof(self.zdict)
+            raw = self._raw_bytes - sum(sys.getsizeof(entry) for entry in self._entries.values()
+                                        if isinstance(entry, str))
+            return dict(
+                self.counters,
+                texts=len(self._entries),
+                compressed_texts=len(compressed),
+                zdict_bytes=len(self.zdict),
+                raw_bytes=raw,
+                stored_bytes=stored,
+                saved_bytes=raw - stored,
+                cached_texts=len(self._cache)
+            )
+
+
 class SafetyContentManager:
-    def __init__(self):
+    # Источники контента: ключ content_db -> метод загрузки
+    CONTENT_SOURCES = {
+        'daily_rules': '_load_daily_rules',
+        'safety_numbers': '_load_safety_numbers',
+        'weekly_tasks': '_load_weekly_tasks',
+        'tech_training': '_load_tech_training',
+        'incident_analysis': '_load_incident_analysis',
+        'psychology': '_load_psychology',
+        'express_tests': '_load_express_tests',
+        'weekly_polls': '_load_weekly_polls'
+    }
+
+    # Бюджет времени (сек) на один вызов Bot API по операциям
+    TELEGRAM_DEADLINES = {
+        'sendMessage': 10.0,
+        'editMessageText': 10.0,
+        'deleteMessage': 5.0,
+        'getChat': 5.0,
+        'getChatMember': 5.0
+    }
+    TELEGRAM_DEFAULT_DEADLINE = 10.0
+    # Сообщение об отказе без обращения к API (цепь разомкнута)
+    TELEGRAM_UNAVAILABLE = "❌ Telegram API временно недоступен (circuit breaker разомкнут)"
+    TELEGRAM_QUEUED = "⏸️ Telegram недоступен, пост поставлен в очередь"
+    OUTBOUND_MAX_ATTEMPTS = 10
+
+    # Длина цикла контента (дни)
+    CYCLE_DAYS = 30
+    # Типы постов и источники контента для "простых" типов (запись = текст)
+    POST_TYPES = ('daily_rule', 'safety_number', 'weekly_task', 'tech_training',
+                  'incident_analysis', 'psychology', 'express_test', 'weekly_poll')
+    POST_TYPE_SOURCES = {
+        'daily_rule': 'daily_rules',
+        'safety_number': 'safety_numbers',
+        'tech_training': 'tech_training',
+        'incident_analysis': 'incident_analysis',
+        'psychology': 'psychology'
+    }
+
+    # Расписание публикаций: время TARGET_TIMEZONE -> (тип поста, название)
+    SCHEDULE_SLOTS = {
+        '08:30': ('daily_rule', '🚦 Правило дня'),
+        '10:00': ('safety_number', '📊 Цифра безопасности'),
+        '13:00': ('tech_training', '🔧 Техническая подготовка'),
+        '16:00': ('incident_analysis', '🔍 Анализ инцидента'),
+        '18:00': ('psychology', '🧠 Психология безопасности')
+    }
+
+    # p99 задержки цикла событий, после которой проверка event_loop - warn
+    LOOP_LAG_WARN_MS = 100
+    # Задержка срабатывания, после которой APScheduler пропускает слот
+    MISFIRE_GRACE_SECONDS = 300
+    CATCHUP_POLICIES = ('all', 'latest', 'skip')
+    # Повторы отложенных произвольных постов: название -> шаг в днях
+    CUSTOM_RECURRENCES = {'daily': 1, 'weekly': 7}
+
+    def __init__(self, db_path: str = None, clock=None, telegram_api=None, start_services: bool = True):
+        """db_path, clock и telegram_api подменяются в режиме симуляции:
+        clock(tz=None) заменяет datetime.now, telegram_api(method, payload) -
+        корутина вместо вызова Bot API. start_services=False не запускает
+        планировщик, проверку подключения и фоновые проверки здоровья.
+        """
+        self.db_path = db_path or os.getenv('DATABASE_PATH', 'safety_bot.db')
+        self.clock = clock or datetime.now
+        # Состояние цикла дней и прочие настройки читаются из кэша процесса
+        self.settings = SettingsCache(self.db_path)
+        if telegram_api is not None:
+            self._call_telegram_api = telegram_api
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-        self.channel_id = os.getenv('TELEGRAM_CHANNEL_ID')
+        # Один или несколько каналов через запятую; первый - основной
+        self.channel_ids = [channel.strip() for channel in os.getenv('TELEGRAM_CHANNEL_ID', '').split(',')
+                            if channel.strip()]
+        self.channel_id = self.channel_ids[0] if self.channel_ids else None
         
         self.server_tz = pytz.timezone(os.getenv('SERVER_TIMEZONE', 'UTC'))
         self.target_tz = pytz.timezone(os.getenv('TARGET_TIMEZONE', 'Asia/Novokuznetsk'))
+
+        # Темп ручных массовых отправок (сек между сообщениями в канал)
+        self.rate_limiter = RateLimiter(float(os.getenv('TELEGRAM_SEND_INTERVAL', '2')))
+        # Общий лимит запросов к Bot API (рассылка по многим каналам)
+        self.api_limiter = PriorityRateLimiter(
+            1 / float(os.getenv('TELEGRAM_GLOBAL_RPS', '25')),
+            os.getenv('TELEGRAM_LANE_WEIGHTS', PriorityRateLimiter.DEFAULT_WEIGHTS)
+        )
+        self.telegram_breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+        )
+        # Общий цикл событий и HTTP-клиент процесса для всех вызовов Bot API
+        self.runtime = AsyncRuntime(int(os.getenv('HTTP_MAX_CONNECTIONS', '100')))
+        # Запись в SQLite из корутин - через поток-писатель, не в цикле событий
+        self.db = SQLiteWriter(self.db_path)
+        self.jobs = PostingJobManager(self.rate_limiter, self.runtime)
+        self.dashboard_events = DashboardEventBroadcaster(
+            self.get_dashboard_state,
+            float(os.getenv('DASHBOARD_EVENTS_INTERVAL', '5')),
+            # По умолчанию SSE может занять не больше четверти потоков воркера
+            int(os.getenv('SSE_MAX_CLIENTS', str(max(1, int(os.getenv('GUNICORN_THREADS', '32')) // 4))))
+        )
+        self.health = HealthProber(float(os.getenv('HEALTH_PROBE_INTERVAL', '60')))
+        self.backup_dir = os.getenv('BACKUP_DIR', 'backups')
+        self.backup_interval_hours = float(os.getenv('BACKUP_INTERVAL_HOURS', '6'))
+        self.backup_metrics = {'last': None, 'total_runs': 0, 'failures': 0}
+        # Догон слотов, пропущенных во время простоя: all | latest | skip
+        self.catchup_policy = os.getenv('CATCHUP_POLICY', 'latest')
+        if self.catchup_policy not in self.CATCHUP_POLICIES:
+            logger.warning(f"Неизвестная CATCHUP_POLICY={self.catchup_policy}, используется latest")
+            self.catchup_policy = 'latest'
+        self.catchup_window_hours = float(os.getenv('CATCHUP_WINDOW_HOURS', '12'))
+        self.catchup_limiter = RateLimiter(float(os.getenv('CATCHUP_SEND_INTERVAL', '120')))
+        # Проверка каналов идет через общий лимит Bot API (полоса bulk)
+        self.audit_concurrency = int(os.getenv('CHANNEL_AUDIT_CONCURRENCY', '50'))
+        self.started_at = self.clock(pytz.utc).isoformat()
         
         if not self.bot_token or not self.channel_id:
             logger.error("TELEGRAM_BOT_TOKEN and TELEGRAM_CHANNEL_ID must be set")
             self.bot_status = "error"
             self.channel_status = "❌ Переменные окружения не установлены"
+            self.health.register('config', lambda: ('fail', self.channel_status))
+            self.health.run_once()
             return
         
         self.bot_status = "active"
         self.scheduler_running = False
+        # Планировщик работает только в одном процессе (несколько воркеров gunicorn)
+        self.scheduler_lock_path = os.getenv('SCHEDULER_LOCK_FILE', f"{self.db_path}.scheduler.lock")
+        self._scheduler_lock = None
         self.init_db()
+        self.content_rotation = os.getenv('CONTENT_ROTATION', 'cycle')
+        self.content_cache_size = int(os.getenv('CONTENT_CACHE_SIZE', '64'))
         self.content_db = self._load_all_content()
-        self.setup_scheduler()
+        self._build_content_index()
+        self.setup_scheduler(start=start_services)
+        if not start_services:
+            return
         
         # Тестируем подключение при запуске
         try:
-            asyncio.run(self.test_channel_connection())
+            self.runtime.run(self.test_channel_connection())
         except Exception as e:
             logger.error(f"Initial connection test failed: {e}")
             self.channel_status = f"❌ Ошибка подключения: {e}"
+
+        # Фоновые проверки здоровья (результаты отдают /health и /ready)
+        self.health.register('database', self._probe_database)
+        self.health.register('scheduler', self._probe_scheduler)
+        self.health.register('queue', self._probe_queue, critical=False)
+        self.health.register('telegram', self._probe_telegram, critical=False)
+        self.health.register('backup', self._probe_backup, critical=False)
+        self.health.register('telegram_breaker', self._probe_breaker, critical=False)
+        self.health.register('event_loop', self._probe_event_loop, critical=False)
+        self.health.start()
+
+        if self.scheduler_running:
+            self.catch_up_missed_slots()
     
-    def get_current_day(self):
-        """Получение текущего дня цикла (1-30)"""
-        try:
-            conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT value FROM system_settings WHERE key = "current_day"')
-            result = cursor.fetchone()
-            
-            if result:
-                current_day = int(result[0])
+    def _day_anchor(self):
+        """Опорная точка цикла: (дата TARGET_TIMEZONE, сквозной номер дня в эту дату).
+
+        Хранится одной строкой "YYYY-MM-DD:номер" в system_settings, поэтому
+        ручной сдвиг дня - один атомарный compare-and-set. При первом запуске
+        точка ставится на сегодня из старых ключей current_day/day_index.
+        """
+        value = self.settings.get('day_anchor')
+        if value is None:
+            today = self.clock(pytz.utc).astimezone(self.target_tz).date()
+            legacy_index = self.settings.get('day_index')
+            legacy_day = self.settings.get('current_day')
+            if legacy_index is not None:
+                day_index = int(legacy_index)
+            elif legacy_day is not None:
+                day_index = int(legacy_day) - 1
             else:
-                # Инициализация: день месяца по модулю 30 + 1
-                current_day = (datetime.now().day - 1) % 30 + 1
-                cursor.execute('INSERT INTO system_settings (key, value) VALUES ("current_day", ?)', (str(current_day),))
+                # Инициализация: день месяца по модулю 30
+                day_index = (today.day - 1) % self.CYCLE_DAYS
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            try:
+                # INSERT OR IGNORE: при гонке процессов остается точка первого
+                conn.execute('INSERT OR IGNORE INTO system_settings (key, value) VALUES ("day_anchor", ?)',
+                             (f"{today.isoformat()}:{day_index}",))
+                conn.execute('DELETE FROM system_settings WHERE key IN ("current_day", "day_index")')
                 conn.commit()
-            
-            conn.close()
-            return current_day
-        except Exception as e:
-            logger.error(f"Error getting current day: {e}")
-            return 1
+            finally:
+                conn.close()
+            value = self.settings.get('day_anchor')
+        anchor_date, anchor_index = value.split(':')
+        return date.fromisoformat(anchor_date), int(anchor_index)
+
+    def day_index_for(self, on_date: date, anchor=None):
+        """Сквозной номер дня для даты TARGET_TIMEZONE (без симуляции переходов).
+
+        anchor - заранее прочитанный _day_anchor() для расчета многих дат подряд.
+        """
+        anchor_date, anchor_index = anchor or self._day_anchor()
+        return anchor_index + (on_date - anchor_date).days
+
+    def day_index_at(self, moment: datetime, anchor=None):
+        """Сквозной номер дня в момент moment (по дате TARGET_TIMEZONE)"""
+        return self.day_index_for(moment.astimezone(self.target_tz).date(), anchor)
+
+    def get_current_day(self):
+        """Получение текущего дня цикла (1-30)"""
+        return self.get_day_index() % self.CYCLE_DAYS + 1
     
-    def set_next_day(self):
-        """Переход к следующему дню цикла"""
+    def get_day_index(self):
+        """Сквозной номер текущего дня с начала работы (для ротации пулов)"""
         try:
-            conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            current_day = self.get_current_day()
-            next_day = current_day % 30 + 1  # 1-30 цикл
-            
-            cursor.execute('UPDATE system_settings SET value = ? WHERE key = "current_day"', (str(next_day),))
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"Переход к дню {next_day}")
-            return next_day
+            return self.day_index_at(self.clock(pytz.utc))
         except Exception as e:
-            logger.error(f"Error setting next day: {e}")
-            return 1
+            logger.error(f"Error getting day index: {e}")
+            return 0
+
+    def set_next_day(self, expected_day: int = None):
+        """Ручной переход к следующему дню цикла.
+
+        Сдвигает опорную точку на день вперед compare-and-set'ом: если
+        expected_day задан и текущий день уже другой (переход сделал другой
+        процесс или повторный клик), ничего не меняет. Возвращает
+        (новый текущий день, выполнен ли переход).
+        """
+        for _ in range(5):
+            anchor_date, anchor_index = self._day_anchor()
+            current_day = self.get_current_day()
+            if expected_day is not None and current_day != expected_day:
+                return current_day, False
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            try:
+                cursor = conn.execute(
+                    'UPDATE system_settings SET value = ? WHERE key = "day_anchor" AND value = ?',
+                    (f"{anchor_date.isoformat()}:{anchor_index + 1}", f"{anchor_date.isoformat()}:{anchor_index}")
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            if cursor.rowcount == 1:
+                next_day = current_day % self.CYCLE_DAYS + 1
+                logger.info(f"Переход к дню {next_day}")
+                return next_day, True
+        raise RuntimeError("не удалось сдвинуть день: опорная точка меняется конкурентно")
         
     async def test_channel_connection(self):
-        """Тестирование подключения к каналу"""
+        """Тестирование подключения к основному каналу (с проверкой прав бота)"""
+        record = await self._audit_channel(self.channel_id, self._bot_user_id())
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"https://api.telegram.org/bot{self.bot_token}/getChat",
-                    params={"chat_id": self.channel_id}
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('ok'):
-                        chat_title = data['result'].get('title', 'Unknown')
-                        self.channel_status = f"✅ Канал: {chat_title}"
-                        logger.info(f"Channel access confirmed: {chat_title}")
-                        return True
-                    else:
-                        error_msg = data.get('description', 'Unknown error')
-                        self.channel_status = f"❌ API Error: {error_msg}"
-                        return False
-                else:
-                    self.channel_status = f"❌ HTTP Error: {response.status_code}"
-                    return False
-                    
+            await self.db.run(self._store_channel_audit, self._conclusive_audit([record]))
         except Exception as e:
-            self.channel_status = f"❌ Connection error: {str(e)}"
-            logger.error(f"Channel access failed: {e}")
+            logger.error(f"Error storing channel audit: {e}")
+        if record['status'] == 'fail':
+            self.channel_status = record['error']
+            logger.error(f"Channel access failed: {record['error']}")
             return False
+        self.channel_status = f"✅ Канал: {record['title']}" if record['status'] == 'ok' else \
+            f"⚠️ Канал: {record['title']} ({record['error']})"
+        logger.info(f"Channel access confirmed: {record['title']}")
+        return True
+
+    def _bot_user_id(self):
+        """Идентификатор бота - числовая часть токена до двоеточия"""
+        prefix = (self.bot_token or '').split(':')[0]
+        return int(prefix) if prefix.isdigit() else None
+
+    @staticmethod
+    def _bot_rights(chat_type: str, member: dict):
+        """Права бота в чате по ответу getChatMember: (публикация, редактирование, удаление)"""
+        status = member.get('status')
+        if status == 'creator':
+            return True, True, True
+        if status == 'administrator':
+            if chat_type == 'channel':
+                return (member.get('can_post_messages', False), member.get('can_edit_messages', False),
+                        member.get('can_delete_messages', False))
+            # В группах бот редактирует и удаляет свои сообщения без отдельных прав
+            return True, True, True
+        if status == 'member':
+            return (chat_type != 'channel',) * 3
+        if status == 'restricted':
+            return (member.get('can_send_messages', False),) * 3
+        return False, False, False
+
+    async def _audit_channel(self, channel: str, bot_id: int):
+        """Проверка одного канала: getChat и getChatMember бота параллельно"""
+        record = {
+            'channel': channel, 'title': None, 'chat_type': None, 'member_status': None,
+            'can_post': False, 'can_edit': False, 'can_delete': False,
+            'status': 'fail', 'error': None, 'latency_ms': None,
+            'checked_at': self._utc_key(self.clock(pytz.utc))
+        }
+        latencies = []
+
+        async def call(method, payload):
+            await self.api_limiter.wait_async()
+            started = time.monotonic()
+            try:
+                return await self._call_telegram_api(method, payload)
+            finally:
+                latencies.append((time.monotonic() - started) * 1000)
+
+        (chat_ok, chat), (member_ok, member) = await asyncio.gather(
+            call('getChat', {'chat_id': channel}),
+            call('getChatMember', {'chat_id': channel, 'user_id': bot_id})
+        )
+        record['latency_ms'] = round(max(latencies), 1)
+        if not chat_ok:
+            record['error'] = chat
+            return record
+        record['title'] = chat.get('title') or chat.get('username') or 'Unknown'
+        record['chat_type'] = chat.get('type')
+        if not member_ok:
+            record['error'] = member
+            return record
+
+        record['member_status'] = member.get('status')
+        record['can_post'], record['can_edit'], record['can_delete'] = self._bot_rights(record['chat_type'], member)
+        if not record['can_post']:
+            record['error'] = f"❌ Бот не может публиковать (статус: {record['member_status']})"
+        elif not (record['can_edit'] and record['can_delete']):
+            record['status'] = 'warn'
+            record['error'] = "нет прав на исправление или удаление постов"
+        else:
+            record['status'] = 'ok'
+        return record
+
+    @staticmethod
+    def _store_channel_audit(conn, records):
+        """Сохранение результатов проверки (последний результат по каждому каналу)"""
+        conn.executemany('''
+            INSERT OR REPLACE INTO channel_audit (channel, title, chat_type, member_status, can_post, can_edit,
+                                                  can_delete, status, error, latency_ms, checked_at)
+            VALUES (:channel, :title, :chat_type, :member_status, :can_post, :can_edit,
+                    :can_delete, :status, :error, :latency_ms, :checked_at)
+        ''', records)
+
+    def _conclusive_audit(self, records):
+        """Записи для сохранения: отказ circuit breaker без вызова API не затирает прошлый результат"""
+        return [record for record in records if record['error'] != self.TELEGRAM_UNAVAILABLE]
+
+    async def audit_channels(self, channels=None):
+        """Параллельная проверка всех каналов (или channels) в общем лимите Bot API.
+
+        Вызовы идут в полосе bulk и не вытесняют рассылку. Результаты
+        сохраняются в channel_audit; возвращает список записей.
+        """
+        bot_id = self._bot_user_id()
+        semaphore = asyncio.Semaphore(self.audit_concurrency)
+
+        async def check(channel):
+            async with semaphore:
+                return await self._audit_channel(channel, bot_id)
+
+        started = time.monotonic()
+        with delivery_lane('bulk'):
+            records = await asyncio.gather(*(check(channel) for channel in channels or self.channel_ids))
+        await self.db.run(self._store_channel_audit, self._conclusive_audit(records))
+        failed = sum(1 for record in records if record['status'] == 'fail')
+        log = logger.warning if failed else logger.info
+        log(f"Проверка {len(records)} каналов за {time.monotonic() - started:.1f} с: недоступно {failed}")
+        return records
+
+    def run_channel_audit(self):
+        """Задание планировщика: проверка всех каналов"""
+        try:
+            return self.runtime.run(self.audit_channels())
+        except Exception as e:
+            logger.error(f"Error auditing channels: {e}")
+            return []
+
+    def get_channel_audit(self):
+        """Последние результаты проверки каналов: сначала проблемные"""
+        try:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute('''
+                SELECT * FROM channel_audit
+                ORDER BY CASE status WHEN 'fail' THEN 0 WHEN 'warn' THEN 1 ELSE 2 END, channel
+            ''').fetchall()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error reading channel audit: {e}")
+            return []
+        configured = set(self.channel_ids)
+        return [dict(row) for row in rows if row['channel'] in configured]
+
+    def _probe_database(self):
+        """Проверка, что БД доступна на запись"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        try:
+            conn.execute('INSERT OR REPLACE INTO system_settings (key, value) VALUES ("health_probe", ?)',
+                         (datetime.now().isoformat(),))
+            conn.commit()
+        finally:
+            conn.close()
+        return 'ok', 'запись выполнена'
+
+    def _probe_scheduler(self):
+        """Проверка, что планировщик работает и задания не зависли"""
+        if not self.scheduler_running:
+            if self.scheduler_running_elsewhere():
+                return 'ok', 'планировщик работает в другом процессе'
+            return 'warn', 'планировщик остановлен'
+        if not self.scheduler.running:
+            return 'fail', 'планировщик не запущен'
+        now = datetime.now(self.server_tz)
+        overdue = [job.id for job in self.scheduler.get_jobs()
+                   if job.next_run_time and (now - job.next_run_time).total_seconds() > 300]
+        if overdue:
+            return 'fail', f"просрочены задания: {', '.join(overdue)}"
+        return 'ok', f"заданий: {len(self.scheduler.get_jobs())}"
+
+    def _probe_queue(self):
+        """Задержка очереди ручных отправок"""
+        lag = self.rate_limiter.backlog()
+        pending = self.jobs.pending_posts()
+        status = 'warn' if lag > 60 else 'ok'
+        return status, {'pending_posts': pending, 'lag_seconds': round(lag, 1),
+                        'api_backlog_seconds': round(self.api_limiter.backlog(), 1),
+                        'api_lanes': self.api_limiter.snapshot()}
+
+    def _probe_backup(self):
+        """Свежесть последней резервной копии"""
+        last = self.backup_metrics['last']
+        if not last:
+            return 'warn', 'резервных копий еще не было'
+        age_hours = (datetime.now() - datetime.fromisoformat(last['finished_at'])).total_seconds() / 3600
+        status = 'warn' if age_hours > 2 * self.backup_interval_hours else 'ok'
+        return status, dict(last, age_hours=round(age_hours, 1))
+
+    def _probe_breaker(self):
+        """Состояние circuit breaker Telegram API"""
+        snapshot = self.telegram_breaker.snapshot()
+        status = {'closed': 'ok', 'half_open': 'warn'}.get(snapshot['state'], 'fail')
+        return status, dict(snapshot, outbound_pending=self.outbound_pending())
+
+    def _probe_event_loop(self):
+        """Задержка общего цикла событий и очередь потока-писателя SQLite"""
+        lag = self.runtime.lag_snapshot()
+        status = 'warn' if lag.get('p99_ms', 0) > self.LOOP_LAG_WARN_MS else 'ok'
+        return status, {'loop_lag': lag, 'sqlite_writer': self.db.snapshot()}
+
+    def _probe_telegram(self):
+        """Проверка доступа к каналу через getChat"""
+        if self.runtime.run(self.test_channel_connection()):
+            return 'ok', self.channel_status
+        return 'fail', self.channel_status
 
     def init_db(self):
         """Инициализация базы данных"""
         try:
-            conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
             cursor = conn.cursor()
             
             # Основная таблица логов публикаций
@@ -412,9 +2031,116 @@ class SafetyContentManager:
                 )
             ''')
             
+            # Канал и message_id в журнале (для баз, созданных до мультиканальности)
+            cursor.execute('PRAGMA table_info(posting_logs)')
+            log_columns = {row[1] for row in cursor.fetchall()}
+            for column, column_type in (('channel', 'TEXT'), ('message_id', 'INTEGER'), ('trace_id', 'TEXT')):
+                if column not in log_columns:
+                    cursor.execute(f'ALTER TABLE posting_logs ADD COLUMN {column} {column_type}')
+
+            # Отправленные сообщения для массового исправления/удаления
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sent_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT,
+                    post_type TEXT,
+                    day INTEGER,
+                    message_id INTEGER,
+                    state TEXT DEFAULT 'sent',
+                    sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sent_messages_post
+                ON sent_messages (post_type, day, channel)
+            ''')
+
+            # Очередь повторной отправки (Telegram недоступен)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbound_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT,
+                    post_type TEXT,
+                    day INTEGER,
+                    content TEXT,
+                    trigger TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    enqueued_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Отработанные слоты расписания (для догона после простоя)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scheduled_slots (
+                    slot TEXT,
+                    slot_time TEXT,
+                    status TEXT,
+                    trigger TEXT,
+                    updated_at TEXT,
+                    PRIMARY KEY (slot, slot_time)
+                ) WITHOUT ROWID
+            ''')
+
+            # Последняя проверка доступа и прав бота по каждому каналу
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS channel_audit (
+                    channel TEXT PRIMARY KEY,
+                    title TEXT,
+                    chat_type TEXT,
+                    member_status TEXT,
+                    can_post INTEGER,
+                    can_edit INTEGER,
+                    can_delete INTEGER,
+                    status TEXT,
+                    error TEXT,
+                    latency_ms REAL,
+                    checked_at TEXT
+                ) WITHOUT ROWID
+            ''')
+
+            # Отложенные произвольные посты (разовые и повторяющиеся)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS custom_posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT,
+                    channels TEXT,
+                    due_at TEXT,
+                    recurrence TEXT,
+                    ends_at TEXT,
+                    status TEXT,
+                    created_at TEXT,
+                    last_sent_at TEXT,
+                    last_result TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_custom_posts_due
+                ON custom_posts (due_at) WHERE status = 'pending'
+            ''')
+
+            # Агрегаты публикаций по часам и дням (время TARGET_TIMEZONE)
+            for table in ('posting_stats_hourly', 'posting_stats_daily'):
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        bucket TEXT,
+                        channel TEXT,
+                        post_type TEXT,
+                        trigger TEXT,
+                        status TEXT,
+                        count INTEGER DEFAULT 0,
+                        PRIMARY KEY (bucket, channel, post_type, trigger, status)
+                    ) WITHOUT ROWID
+                ''')
+            
             cursor.execute('SELECT COUNT(*) FROM bot_stats')
             if cursor.fetchone()[0] == 0:
                 cursor.execute('INSERT INTO bot_stats (posts_sent) VALUES (0)')
+
+            cursor.execute('SELECT COUNT(*) FROM posting_stats_daily')
+            if cursor.fetchone()[0] == 0:
+                self._backfill_rollups(cursor)
             
             conn.commit()
             conn.close()
@@ -423,17 +2149,35 @@ class SafetyContentManager:
             logger.error(f"Error initializing database: {e}")
 
     def _load_all_content(self):
-        """Загрузка полного контента на 30 дней"""
-        return {
-            'daily_rules': self._load_daily_rules(),
-            'safety_numbers': self._load_safety_numbers(),
-            'weekly_tasks': self._load_weekly_tasks(),
-            'tech_training': self._load_tech_training(),
-            'incident_analysis': self._load_incident_analysis(),
-            'psychology': self._load_psychology(),
-            'express_tests': self._load_express_tests(),
-            'weekly_polls': self._load_weekly_polls()
+        """Загрузка полного контента на 30 дней (и дополнительных пулов)"""
+        content_db = {
+            source: getattr(self, loader)()
+            for source, loader in self.CONTENT_SOURCES.items()
         }
+        self._extend_content_pools(content_db)
+        return content_db
+
+    def _extend_content_pools(self, content_db: dict):
+        """Дополнение пулов из CONTENT_POOLS_FILE: {post_type: [текст, ...]}.
+
+        Записи пула нумеруются после базовых 30 дней (31, 32, ...), так что
+        журнал, исправления и переопределения адресуют их как обычные дни.
+        """
+        path = os.getenv('CONTENT_POOLS_FILE', 'content_pools.json')
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            pools = json.load(f)
+        for post_type, items in pools.items():
+            source = self.POST_TYPE_SOURCES.get(post_type)
+            if source is None:
+                logger.warning(f"Пул для {post_type} не поддерживается: только ежедневные типы")
+                continue
+            entries = content_db[source]
+            next_number = max(entries, default=0) + 1
+            for offset, text in enumerate(items):
+                entries[next_number + offset] = text
+        logger.info(f"Загружены пулы контента: " + ", ".join(f"{k}: +{len(v)}" for k, v in pools.items()))
 
     def _load_daily_rules(self):
         """Правила дня из ПТЭ РФ (приказ №250) - 30 правил"""
@@ -1232,25 +2976,194 @@ class SafetyContentManager:
             }
         }
 
-    def _get_weekly_task_content(self, day: int):
+    def _get_weekly_task_content(self, day: int, content_db: dict = None):
         """Получение контента ситуационной задачи (1 задача в неделю)"""
         week = (day - 1) // 5 + 1  # 5 дней = 1 неделя (6 недель для 30 дней)
-        task_data = self.content_db['weekly_tasks'].get(week)
+        task_data = (content_db or self.content_db)['weekly_tasks'].get(week)
         return task_data['scenario'] if task_data else None
 
-    def _get_express_test_content(self, day: int):
+    def _get_express_test_content(self, day: int, content_db: dict = None):
         """Получение контента экспресс-теста"""
-        test_data = self.content_db['express_tests'].get(day)
+        test_data = (content_db or self.content_db)['express_tests'].get(day)
         return test_data['question'] if test_data else None
 
-    def _get_weekly_poll_content(self, day: int):
+    def _get_weekly_poll_content(self, day: int, content_db: dict = None):
         """Получение контента опроса (1 опрос в неделю)"""
         week = (day - 1) // 5 + 1  # 5 дней = 1 неделя (6 недель для 30 дней)
-        poll_data = self.content_db['weekly_polls'].get(week)
+        poll_data = (content_db or self.content_db)['weekly_polls'].get(week)
         return poll_data['question'] if poll_data else None
 
-    def setup_scheduler(self):
-        """Настройка планировщика"""
+    def _load_content_overlays(self):
+        """Региональные и деповские переопределения контента из CONTENT_OVERLAYS_FILE.
+
+        Формат: {"regions": {регион: {источник: {день: запись}}},
+                 "depots": {депо: {"region": регион, "content": {источник: {день: запись}}}},
+                 "channels": {канал: депо}}
+        """
+        overlays = {'regions': {}, 'depots': {}, 'channels': {}}
+        path = os.getenv('CONTENT_OVERLAYS_FILE', 'content_overlays.json')
+        if not os.path.exists(path):
+            return overlays
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        def normalize(layer):
+            # Ключи дней в JSON - строки
+            return {source: {int(day): entry for day, entry in entries.items()}
+                    for source, entries in layer.items()}
+
+        overlays['regions'] = {name: normalize(layer) for name, layer in data.get('regions', {}).items()}
+        overlays['depots'] = {
+            name: {'region': depot.get('region'), 'content': normalize(depot.get('content', {}))}
+            for name, depot in data.get('depots', {}).items()
+        }
+        overlays['channels'] = dict(data.get('channels', {}))
+        return overlays
+
+    def _build_content_index(self):
+        """Сброс кеша эффективного контента и расчет версии контента.
+
+        Разрешенные слои (база -> регион -> депо) строятся один раз на версию
+        контента и разделяются всеми каналами одного депо. Тексты хранятся в
+        сжатом content_store; исходные записи после этого не удерживаются и
+        перечитываются только для варианта нового канала.
+        RSS процесса до и после сборки сохраняется в content_rss - измеренный,
+        а не оценочный эффект хранилища (см. /debug/memory).
+        """
+        rss_before = process_rss_bytes()
+        if self.content_db is None:
+            self.content_db = self._load_all_content()
+        self.content_overlays = self._load_content_overlays()
+        serialized = json.dumps([self.content_db, self.content_overlays], ensure_ascii=False, sort_keys=True)
+        self.content_version = hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:16]
+        compiled = self._compiled_text_ids()
+        self.content_store = ContentStore(
+            (text for text in self._content_texts() if id(text) not in compiled),
+            self.content_cache_size
+        )
+        self._resolved_content = {}
+        self._resolved_pools = {}
+        self._channel_layers = {}
+        for channel in [None] + self.channel_ids:
+            self._resolve_channel(channel)
+        self.content_db = None
+        gc.collect()
+        rss_after = process_rss_bytes()
+        self.content_rss = {
+            'rss_before_bytes': rss_before,
+            'rss_after_bytes': rss_after,
+            'rss_delta_bytes': rss_after - rss_before
+        }
+
+        stats = self.content_store.stats()
+        logger.info(f"Контент версии {self.content_version}: "
+                    f"{len(self._resolved_content)} вариантов для {len(self.channel_ids)} каналов, "
+                    f"{stats['texts']} текстов, сжато {stats['compressed_texts']}: "
+                    f"{stats['raw_bytes'] // 1024} КБ -> {stats['stored_bytes'] // 1024} КБ (оценка), "
+                    f"RSS {rss_before // 1024} КБ -> {rss_after // 1024} КБ")
+
+    def _content_texts(self):
+        """Все тексты базового контента, пулов и переопределений"""
+        layers = [self.content_db] + list(self.content_overlays['regions'].values()) + [
+            depot.get('content', {}) for depot in self.content_overlays['depots'].values()
+        ]
+        for layer in layers:
+            for entries in layer.values():
+                for entry in entries.values():
+                    if isinstance(entry, dict):
+                        yield from (value for value in entry.values() if isinstance(value, str))
+                    elif isinstance(entry, str):
+                        yield entry
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _compiled_text_ids(cls):
+        """id строк-констант методов загрузки контента.
+
+        Эти тексты и так постоянно в памяти как константы кода app.py: сжатие
+        добавило бы копию, поэтому content_store хранит их без сжатия.
+        """
+        return frozenset(
+            id(const)
+            for loader in cls.CONTENT_SOURCES.values()
+            for const in getattr(cls, loader).__code__.co_consts
+            if isinstance(const, str)
+        )
+
+    def _layer_key(self, channel: str):
+        """Ключ слоев канала: (регион, депо); (None, None) - только базовый пакет"""
+        depot = self.content_overlays['channels'].get(channel)
+        region = self.content_overlays['depots'].get(depot, {}).get('region')
+        return region, depot
+
+    def _resolve_channel(self, channel: str = None):
+        """Эффективное отображение (post_type, day) -> текст для канала (с кешем)"""
+        key = self._channel_layers.get(channel)
+        if key is None:
+            key = self._layer_key(channel) if channel else (None, None)
+            self._channel_layers[channel] = key
+        resolved = self._resolved_content.get(key)
+        if resolved is None:
+            compiled = self._compiled_text_ids()
+            resolved = self._resolved_content[key] = {
+                item: self.content_store.put(text, compress=id(text) not in compiled)
+                for item, text in self._resolve_layers(*key).items()
+            }
+            # Упорядоченные номера пула по типам - для ротации без повторов
+            self._resolved_pools[key] = {
+                post_type: sorted(day for (pool_type, day) in resolved if pool_type == post_type)
+                for post_type in self.POST_TYPE_SOURCES
+            }
+        return resolved
+
+    def _content_pool(self, post_type: str, channel: str = None):
+        """Номера записей пула типа post_type для канала (по возрастанию)"""
+        self._resolve_channel(channel)
+        return self._resolved_pools[self._channel_layers[channel]][post_type]
+
+    def _resolve_layers(self, region: str, depot: str):
+        content_db = self.content_db if self.content_db is not None else self._load_all_content()
+        merged = {source: dict(entries) for source, entries in content_db.items()}
+        layers = (
+            self.content_overlays['regions'].get(region, {}),
+            self.content_overlays['depots'].get(depot, {}).get('content', {})
+        )
+        for layer in layers:
+            for source, entries in layer.items():
+                merged.setdefault(source, {}).update(entries)
+        resolved = {}
+        for post_type in self.POST_TYPES:
+            source = self.POST_TYPE_SOURCES.get(post_type)
+            # Ежедневные типы - весь пул, остальные - дни цикла
+            days = sorted(merged[source]) if source else range(1, self.CYCLE_DAYS + 1)
+            for day in days:
+                content = self._select_content(merged, post_type, day)
+                if content:
+                    resolved[(post_type, day)] = content
+        return resolved
+
+    def _scheduled_day(self, post_type: str, channel: str = None, day_index: int = None):
+        """Номер записи (день) для планового поста канала.
+
+        В режиме CONTENT_ROTATION=cycle - текущий день 30-дневного цикла; в режиме
+        pool - очередная запись пула канала без повторов до исчерпания пула.
+        """
+        if self.content_rotation != 'pool' or post_type not in self.POST_TYPE_SOURCES:
+            return self.get_current_day() if day_index is None else day_index % self.CYCLE_DAYS + 1
+        pool = self._content_pool(post_type, channel)
+        if not pool:
+            return None
+        if day_index is None:
+            day_index = self.get_day_index()
+        return pool[rotation_pick(channel, post_type, len(pool), day_index)]
+
+    def reload_content(self):
+        """Перечитать переопределения и сбросить кеш разрешенного контента"""
+        self._build_content_index()
+        return self.content_version
+
+    def setup_scheduler(self, start: bool = True):
+        """Настройка планировщика (start=False - только задания, без запуска)"""
         try:
             self.scheduler = BackgroundScheduler(timezone=str(self.server_tz))
             
@@ -1262,27 +3175,63 @@ class SafetyContentManager:
                 id='keep_alive'
             )
 
-            # Автоматический переход на следующий день в 00:00
+            # Отдельного задания перехода дня нет: день цикла вычисляется по дате
+            # TARGET_TIMEZONE (см. day_index_for)
+
+            # Догон слотов, пропущенных дольше misfire_grace_time
+            self.scheduler.add_job(
+                self.catch_up_missed_slots,
+                'interval',
+                minutes=15,
+                id='catchup',
+                name='Догон пропущенных слотов',
+                max_instances=1
+            )
+
+            # Повторная отправка постов, отложенных при недоступности Telegram
+            self.scheduler.add_job(
+                self.drain_outbound_queue,
+                'interval',
+                seconds=30,
+                id='outbound_drain',
+                name='Очередь повторной отправки',
+                max_instances=1
+            )
+
+            # Отложенные произвольные посты (таблица custom_posts)
+            self.scheduler.add_job(
+                self.dispatch_custom_posts,
+                'interval',
+                seconds=30,
+                id='custom_posts',
+                name='Отложенные произвольные посты',
+                max_instances=1
+            )
+
+            # Проверка доступа и прав бота во всех каналах
+            self.scheduler.add_job(
+                self.run_channel_audit,
+                'interval',
+                hours=float(os.getenv('CHANNEL_AUDIT_INTERVAL_HOURS', '6')),
+                id='channel_audit',
+                name='Проверка каналов',
+                max_instances=1
+            )
+
+            # Онлайн-резервная копия БД
             self.scheduler.add_job(
-                self.set_next_day,
-                'cron',
-                hour=0, minute=0,
-                id='next_day'
+                self.backup_database,
+                'interval',
+                hours=self.backup_interval_hours,
+                id='backup',
+                name='Резервная копия БД'
             )
 
             # Расписание публикаций (согласованное расписание)
-            schedule_config = {
-                '08:30': ('daily_rule', '🚦 Правило дня'),
-                '10:00': ('safety_number', '📊 Цифра безопасности'), 
-                '13:00': ('tech_training', '🔧 Техническая подготовка'),
-                '16:00': ('incident_analysis', '🔍 Анализ инцидента'),
-                '18:00': ('psychology', '🧠 Психология безопасности')
-            }
-            
-            for time_str, (post_type, name) in schedule_config.items():
+            for time_str, (post_type, name) in self.SCHEDULE_SLOTS.items():
                 kemerovo_time = datetime.strptime(time_str, '%H:%M').time()
                 server_time = self.target_tz.localize(
-                    datetime.combine(datetime.now().date(), kemerovo_time)
+                    datetime.combine(self.clock().date(), kemerovo_time)
                 ).astimezone(self.server_tz)
                 
                 trigger = CronTrigger(
@@ -1292,14 +3241,19 @@ class SafetyContentManager:
                 )
                 
                 self.scheduler.add_job(
-                    self.send_scheduled_post,
+                    self.run_scheduled_post,
                     trigger=trigger,
                     args=[post_type],
                     id=f"auto_{post_type}",
                     name=f"Авто: {name}",
-                    misfire_grace_time=300
+                    misfire_grace_time=self.MISFIRE_GRACE_SECONDS
                 )
 
+            if not start:
+                return
+            if not self._acquire_scheduler_lock():
+                logger.info("Планировщик работает в другом процессе, этот процесс только обслуживает запросы")
+                return
             self.scheduler.start()
             self.scheduler_running = True
             logger.info("Планировщик запущен с 30-дневным циклом контента")
@@ -1307,124 +3261,842 @@ class SafetyContentManager:
         except Exception as e:
             logger.error(f"Error starting scheduler: {e}")
 
-    async def send_scheduled_post(self, post_type: str):
-        """Автоматическая отправка поста с учетом текущего дня"""
+    def run_scheduled_post(self, post_type: str):
+        """Точка входа задания планировщика: BackgroundScheduler не выполняет корутины сам"""
+        moment = self._last_slot_moment(post_type)
+        if moment and not self._claim_slot(post_type, moment, 'auto', 'running'):
+            logger.info(f"Слот {post_type} {moment.isoformat()} уже обработан")
+            return
+        with tracer.span('scheduler_fire', post_type=post_type,
+                         slot_time=moment.isoformat() if moment else None,
+                         fire_lag_ms=round((self.clock(pytz.utc) - moment).total_seconds() * 1000) if moment else None), \
+                delivery_lane('scheduled'):
+            success = self.runtime.run(self.send_scheduled_post(post_type))
+        if moment:
+            self._claim_slot(post_type, moment, 'auto', 'sent' if success else 'failed', finish=True)
+
+    @traced(root=True)
+    async def send_scheduled_post(self, post_type: str, day_index: int = None, trigger: str = "auto"):
+        """Автоматическая отправка поста с учетом текущего дня.
+
+        day_index - сквозной номер дня слота (при догоне пропущенных слотов).
+        Возвращает True при отправке (или постановке в очередь) хотя бы в один канал.
+        """
+        set_span_tag('post_type', post_type)
+        set_span_tag('trigger', trigger)
         try:
-            current_day = self.get_current_day()
-            content = self._get_content_by_type(post_type, current_day)
+            current_day = self.get_current_day() if day_index is None else day_index % self.CYCLE_DAYS + 1
+            content = self._get_content_by_type(post_type, self._scheduled_day(post_type, day_index=day_index))
             
             if content:
-                success, result = await self.send_telegram_message(content)
+                success, result = await self._deliver(post_type, None, trigger, day_index=day_index)
                 
                 if success:
-                    self._log_posting(post_type, content, "auto", current_day)
-                    self._update_stats()
                     logger.info(f"Авто-публикация {post_type} (день {current_day}) успешна")
                 else:
                     logger.error(f"Ошибка авто-публикации {post_type}: {result}")
+                return success
             else:
                 logger.warning(f"Контент для {post_type} (день {current_day}) не найден")
                 
         except Exception as e:
             logger.error(f"Ошибка в send_scheduled_post: {e}")
+        return False
 
-    async def send_manual_post(self, post_type: str, content_day: int = None, custom_text: str = None):
-        """Ручная отправка поста с выбором дня"""
+    def _slot_moments(self, slot: str, since: datetime, until: datetime):
+        """Моменты срабатывания слота (тип поста) в интервале (since, until]"""
+        tz = self.target_tz
+        times = [datetime.strptime(time_str, '%H:%M').time()
+                 for time_str, (post_type, _) in self.SCHEDULE_SLOTS.items() if post_type == slot]
+        date = since.astimezone(tz).date()
+        while date <= until.astimezone(tz).date():
+            for slot_time in times:
+                moment = tz.localize(datetime.combine(date, slot_time))
+                if since < moment <= until:
+                    yield moment
+            date += timedelta(days=1)
+
+    def _last_slot_moment(self, slot: str):
+        """Момент слота, который срабатывает сейчас (последний не позже текущего времени)"""
+        now = self.clock(pytz.utc)
+        return max(self._slot_moments(slot, now - timedelta(days=1), now), default=None)
+
+    def _claim_slot(self, slot: str, moment: datetime, trigger: str, status: str, finish: bool = False):
+        """Атомарная отметка слота в scheduled_slots.
+
+        Возвращает False, если слот уже обработан другим запуском. Слоты,
+        оставленные в очереди догона прошлым процессом ('queued'), можно
+        занять заново. finish=True - обновить статус уже занятого слота.
+        """
         try:
-            if post_type == 'custom' and custom_text:
-                content = custom_text
-            else:
-                day = content_day or self.get_current_day()
-                content = self._get_content_by_type(post_type, day)
-            
-            if not content:
-                return "❌ Контент не найден"
-            
-            success, result = await self.send_telegram_message(content)
-            
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            claimed = self._write_slot(conn, slot, moment, trigger, status, finish)
+            conn.commit()
+            conn.close()
+            return claimed
+        except Exception as e:
+            logger.error(f"Error claiming slot {slot}: {e}")
+            return True
+
+    async def _claim_slot_async(self, slot: str, moment: datetime, trigger: str, status: str,
+                                finish: bool = False):
+        """_claim_slot для корутин: запись через поток-писатель, не в цикле событий"""
+        try:
+            return await self.db.run(self._write_slot, slot, moment, trigger, status, finish)
+        except Exception as e:
+            logger.error(f"Error claiming slot {slot}: {e}")
+            return True
+
+    def _write_slot(self, conn, slot: str, moment: datetime, trigger: str, status: str, finish: bool):
+        slot_time = moment.astimezone(pytz.utc).isoformat()
+        now = self.clock(pytz.utc).isoformat()
+        if finish:
+            cursor = conn.execute(
+                'UPDATE scheduled_slots SET status = ?, updated_at = ? WHERE slot = ? AND slot_time = ?',
+                (status, now, slot, slot_time)
+            )
+        else:
+            cursor = conn.execute('''
+                INSERT INTO scheduled_slots (slot, slot_time, status, trigger, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (slot, slot_time) DO UPDATE SET
+                    status = excluded.status, trigger = excluded.trigger, updated_at = excluded.updated_at
+                WHERE scheduled_slots.status = 'queued' AND scheduled_slots.updated_at < ?
+            ''', (slot, slot_time, status, trigger, now, self.started_at))
+        return cursor.rowcount == 1
+
+    def find_missed_slots(self):
+        """Пропущенные слоты за последние CATCHUP_WINDOW_HOURS.
+
+        Пропущенным считается слот старше misfire_grace_time без отметки в
+        scheduled_slots (или оставленный в очереди догона прошлым процессом).
+        Отсчет не раньше первого отмеченного слота, чтобы первый запуск на
+        новой БД ничего не догонял. Возвращает [(слот, момент)] по времени.
+        """
+        now = self.clock(pytz.utc)
+        try:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            first = conn.execute('SELECT MIN(slot_time) FROM scheduled_slots').fetchone()[0]
+            if not first:
+                conn.close()
+                return []
+            since = max(now - timedelta(hours=self.catchup_window_hours), datetime.fromisoformat(first))
+            done = set(conn.execute('''
+                SELECT slot, slot_time FROM scheduled_slots
+                WHERE slot_time >= ? AND NOT (status = 'queued' AND updated_at < ?)
+            ''', (since.isoformat(), self.started_at)).fetchall())
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error finding missed slots: {e}")
+            return []
+
+        until = now - timedelta(seconds=self.MISFIRE_GRACE_SECONDS)
+        slots = [post_type for post_type, _ in self.SCHEDULE_SLOTS.values()]
+        missed = [(slot, moment) for slot in slots for moment in self._slot_moments(slot, since, until)
+                  if (slot, moment.astimezone(pytz.utc).isoformat()) not in done]
+        return sorted(missed, key=lambda item: item[1])
+
+    def catch_up_missed_slots(self):
+        """Догон пропущенных слотов по политике CATCHUP_POLICY.
+
+        День контента для слота вычисляется по его дате, посты уходят
+        отдельным заданием с темпом CATCHUP_SEND_INTERVAL и не задерживают
+        текущие слоты.
+        Возвращает идентификатор задания догона или None.
+        """
+        missed = self.find_missed_slots()
+        if not missed:
+            return None
+
+        if self.catchup_policy == 'all':
+            keep = set(missed)
+        elif self.catchup_policy == 'latest':
+            keep = set({slot: moment for slot, moment in missed}.items())
+        else:
+            keep = set()
+
+        anchor = self._day_anchor()
+        items = []
+        for slot, moment in missed:
+            status = 'queued' if (slot, moment) in keep else 'skipped'
+            if not self._claim_slot(slot, moment, 'catchup', status):
+                continue
+            local_time = moment.astimezone(self.target_tz).strftime('%d.%m %H:%M')
+            if status == 'skipped':
+                logger.warning(f"Пропущенный слот {slot} {local_time} не отправляется "
+                               f"(CATCHUP_POLICY={self.catchup_policy})")
+                continue
+            items.append({
+                'post_type': slot,
+                'slot_time': local_time,
+                'moment': moment,
+                'day_index': self.day_index_at(moment, anchor)
+            })
+
+        if not items:
+            return None
+
+        async def worker(item):
+            success = await self.send_scheduled_post(item['post_type'], item['day_index'], "catchup")
+            await self._claim_slot_async(item['post_type'], item['moment'], 'catchup',
+                                         'sent' if success else 'failed', finish=True)
             if success:
-                day_used = content_day or self.get_current_day()
-                self._log_posting(post_type, content, "manual", day_used)
-                self._update_stats()
+                return True, f"✅ Слот {item['slot_time']} отправлен"
+            return False, f"❌ Слот {item['slot_time']} не отправлен"
+
+        logger.warning(f"Догон {len(items)} пропущенных слотов (CATCHUP_POLICY={self.catchup_policy})")
+        return self.jobs.start(worker, items, 'Догон пропущенных слотов', rate_limiter=self.catchup_limiter)
+
+    @traced(root=True)
+    async def send_manual_post(self, post_type: str, content_day: int = None, custom_text: str = None,
+                               urgent: bool = False):
+        """Ручная отправка поста с выбором дня (urgent - срочная, вне очереди Bot API).
+
+        Возвращает (успех, текст результата), как _deliver.
+        """
+        set_span_tag('post_type', post_type)
+        lane = 'emergency' if urgent else _delivery_lane.get()
+        set_span_tag('lane', lane)
+        try:
+            day = content_day or self.get_current_day()
+            set_span_tag('day', day)
+            custom_text = custom_text if post_type == 'custom' else None
+            if not custom_text and not self._get_content_by_type(post_type, day):
+                return False, "❌ Контент не найден"
             
-            return result
+            with delivery_lane(lane):
+                return await self._deliver(post_type, day, "manual", custom_text)
             
         except Exception as e:
             error_msg = f"❌ Ошибка отправки: {str(e)}"
             logger.error(error_msg)
-            return error_msg
-
-    def _get_content_by_type(self, post_type: str, day: int):
-        """Получение контента по типу и дню"""
-        content_map = {
-            'daily_rule': self.content_db['daily_rules'].get(day),
-            'safety_number': self.content_db['safety_numbers'].get(day),
-            'weekly_task': self._get_weekly_task_content(day),
-            'tech_training': self.content_db['tech_training'].get(day),
-            'incident_analysis': self.content_db['incident_analysis'].get(day),
-            'psychology': self.content_db['psychology'].get(day),
-            'express_test': self._get_express_test_content(day),
-            'weekly_poll': self._get_weekly_poll_content(day),
-        }
-        return content_map.get(post_type)
-
-    async def send_telegram_message(self, text: str):
-        """Отправка сообщения в Telegram"""
+            return False, error_msg
+
+    async def _deliver(self, post_type: str, day: int, trigger: str, custom_text: str = None,
+                       day_index: int = None, channels=None):
+        """Отправка поста во все каналы (или channels) с сохранением message_id.
+
+        Контент берется с учетом переопределений каждого канала (или custom_text);
+        day=None - плановый выбор записи для каждого канала (_scheduled_day)
+        на сквозной день day_index (по умолчанию текущий).
+        Возвращает (успех, текст результата): успех - пост доставлен или
+        поставлен в очередь повторной отправки хотя бы в одном канале, то есть
+        повторный запуск его бы продублировал.
+        """
+        if day is None and day_index is None:
+            day_index = self.get_day_index()
+
+        def log_delivery(channel, item_day, outcome, result, latency_ms=None, message_id=None):
+            logger.info(f"Доставка {post_type} в {channel}: {result}", extra={
+                'post_type': post_type,
+                'day': item_day,
+                'channel': channel,
+                'trigger': trigger,
+                'outcome': outcome,
+                'latency_ms': latency_ms,
+                'message_id': message_id
+            })
+
+        @traced('deliver')
+        async def send_to(channel):
+            set_span_tag('channel', channel)
+            item_day = day if day is not None else self._scheduled_day(post_type, channel, day_index)
+            content = custom_text or self._get_content_by_type(post_type, item_day, channel)
+            if not content:
+                log_delivery(channel, item_day, 'no_content', "❌ Контент не найден")
+                return False, "❌ Контент не найден"
+            if self.telegram_breaker.is_open():
+                # Не ждем таймаутов: пост уходит в очередь повторной отправки
+                await self._enqueue_outbound(channel, post_type, item_day, content, trigger,
+                                             self.TELEGRAM_UNAVAILABLE)
+                log_delivery(channel, item_day, 'queued', self.TELEGRAM_UNAVAILABLE)
+                return False, self.TELEGRAM_QUEUED
+            await self.api_limiter.wait_async()
+            started = time.monotonic()
+            success, result, message_id = await self.send_telegram_message(content, channel)
+            latency_ms = round((time.monotonic() - started) * 1000, 1)
+            # Отказ без вызова API (цепь разомкнута или half_open занят пробным
+            # вызовом) или сбой, разомкнувший цепь: пост уходит в очередь
+            if not success and (result == self.TELEGRAM_UNAVAILABLE or self.telegram_breaker.is_open()):
+                await self._enqueue_outbound(channel, post_type, item_day, content, trigger, result)
+                log_delivery(channel, item_day, 'queued', result, latency_ms)
+                return False, self.TELEGRAM_QUEUED
+            log_delivery(channel, item_day, 'sent' if success else 'failed', result, latency_ms, message_id)
+            if success:
+                await self._record_sent_message(channel, post_type, item_day, message_id)
+                await self._log_posting(post_type, content, trigger, item_day, channel=channel, message_id=message_id)
+                await self._update_stats()
+            else:
+                await self._log_posting(post_type, content, trigger, item_day, status='failed', channel=channel)
+            return success, result
+
+        results = await asyncio.gather(*(send_to(channel) for channel in channels or self.channel_ids))
+        delivered = sum(1 for success, _ in results if success)
+        queued = sum(1 for _, result in results if result == self.TELEGRAM_QUEUED)
+        errors = [result for success, result in results if not success and result != self.TELEGRAM_QUEUED]
+        if len(results) == 1:
+            return delivered + queued > 0, results[0][1]
+        if delivered == len(results):
+            return True, f"✅ Сообщение отправлено в {delivered} каналов!"
+        if not errors:
+            if not delivered:
+                return True, self.TELEGRAM_QUEUED
+            return True, f"⏸️ Отправлено в {delivered} из {len(results)} каналов, остальные поставлены в очередь"
+        return delivered + queued > 0, f"❌ Отправлено в {delivered} из {len(results)} каналов: {errors[0]}"
+
+    @traced()
+    def _get_content_by_type(self, post_type: str, day: int, channel: str = None):
+        """Получение контента по типу и дню (с учетом переопределений канала)"""
+        ref = self._resolve_channel(channel).get((post_type, day))
+        return self.content_store.get(ref) if ref else None
+
+    def _select_content(self, content_db: dict, post_type: str, day: int):
+        """Выбор записи контента по типу и дню из набора источников"""
+        if post_type == 'weekly_task':
+            return self._get_weekly_task_content(day, content_db)
+        if post_type == 'express_test':
+            return self._get_express_test_content(day, content_db)
+        if post_type == 'weekly_poll':
+            return self._get_weekly_poll_content(day, content_db)
+        source = self.POST_TYPE_SOURCES.get(post_type)
+        return content_db[source].get(day) if source else None
+
+    async def _call_telegram_api(self, method: str, payload: dict):
+        """Вызов метода Bot API. Возвращает (успех, result или текст ошибки).
+
+        Время вызова ограничено бюджетом операции (TELEGRAM_DEADLINES), сбои
+        сети и 5xx/429 учитывает circuit breaker; при разомкнутой цепи вызов
+        сразу возвращает TELEGRAM_UNAVAILABLE.
+        """
+        if not self.telegram_breaker.allow():
+            return False, self.TELEGRAM_UNAVAILABLE
+
+        deadline = self.TELEGRAM_DEADLINES.get(method, self.TELEGRAM_DEFAULT_DEADLINE)
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"https://api.telegram.org/bot{self.bot_token}/sendMessage",
-                    json={
-                        "chat_id": self.channel_id,
-                        "text": text,
-                        "parse_mode": "HTML"
-                    }
-                )
+            response = await asyncio.wait_for(
+                self._http_post(f"https://api.telegram.org/bot{self.bot_token}/{method}", payload, deadline),
+                timeout=deadline
+            )
+            
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            if response.status_code >= 500 or response.status_code == 429:
+                error = f"❌ HTTP error: {response.status_code}"
+                self.telegram_breaker.record_failure(error)
+                return False, error
+            # Ответ API (в том числе 4xx) означает, что сервис доступен
+            self.telegram_breaker.record_success()
+            if response.status_code == 200 and data.get('ok'):
+                return True, data.get('result')
+            if data.get('description'):
+                return False, f"❌ Telegram API error: {data.get('description')}"
+            return False, f"❌ HTTP error: {response.status_code}"
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('ok'):
-                        return True, "✅ Сообщение отправлено в канал!"
-                    else:
-                        return False, f"❌ Telegram API error: {data.get('description')}"
+        except asyncio.TimeoutError:
+            error = f"❌ Timeout: {method} дольше {deadline:g} с"
+            self.telegram_breaker.record_failure(error)
+            return False, error
+        except Exception as e:
+            error = f"❌ Connection error: {str(e)}"
+            self.telegram_breaker.record_failure(error)
+            return False, error
+
+    async def _http_post(self, url: str, payload: dict, timeout: float):
+        """POST через общий клиент процесса (вне общего цикла - разовый клиент)"""
+        if self.runtime.in_loop():
+            return await self.runtime.client.post(url, json=payload, timeout=timeout)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            return await client.post(url, json=payload)
+
+    @traced()
+    async def send_telegram_message(self, text: str, chat_id: str = None):
+        """Отправка сообщения в Telegram. Возвращает (успех, текст результата, message_id)"""
+        success, result = await self._call_telegram_api('sendMessage', {
+            "chat_id": chat_id or self.channel_id,
+            "text": text,
+            "parse_mode": "HTML"
+        })
+        if success:
+            return True, "✅ Сообщение отправлено в канал!", result.get('message_id')
+        return False, result, None
+
+    async def edit_telegram_message(self, chat_id: str, message_id: int, text: str):
+        """Замена текста ранее отправленного сообщения"""
+        success, result = await self._call_telegram_api('editMessageText', {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": text,
+            "parse_mode": "HTML"
+        })
+        if not success and 'message is not modified' in result:
+            return True, "✅ Текст уже актуален"
+        return success, "✅ Сообщение исправлено" if success else result
+
+    async def delete_telegram_message(self, chat_id: str, message_id: int):
+        """Удаление ранее отправленного сообщения"""
+        success, result = await self._call_telegram_api('deleteMessage', {
+            "chat_id": chat_id,
+            "message_id": message_id
+        })
+        return success, "✅ Сообщение удалено" if success else result
+
+    async def _enqueue_outbound(self, channel: str, post_type: str, day: int, content: str, trigger: str,
+                                error: str):
+        """Постановка поста в очередь повторной отправки"""
+        def write(conn):
+            conn.execute('''
+                INSERT INTO outbound_queue (channel, post_type, day, content, trigger, last_error)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (channel, post_type, day, content, trigger, error))
+
+        try:
+            await self.db.run(write)
+            logger.warning(f"Пост {post_type} (день {day}) для {channel} поставлен в очередь: {error}")
+        except Exception as e:
+            logger.error(f"Error enqueueing outbound post: {e}")
+
+    def outbound_pending(self):
+        """Число постов в очереди повторной отправки"""
+        try:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            count = conn.execute('SELECT COUNT(*) FROM outbound_queue').fetchone()[0]
+            conn.close()
+            return count
+        except Exception as e:
+            logger.error(f"Error counting outbound queue: {e}")
+            return 0
+
+    def drain_outbound_queue(self):
+        """Повторная отправка отложенных постов (задание планировщика)"""
+        if self.telegram_breaker.is_open():
+            return
+        with delivery_lane('bulk'):
+            self.runtime.run(self._drain_outbound_async())
+
+    async def _drain_outbound_async(self, batch_size: int = 50):
+        rows = await self.db.run(lambda conn: conn.execute('''
+            SELECT id, channel, post_type, day, content, trigger, attempts
+            FROM outbound_queue ORDER BY id LIMIT ?
+        ''', (batch_size,)).fetchall())
+
+        for row_id, channel, post_type, day, content, trigger, attempts in rows:
+            if self.telegram_breaker.is_open():
+                break
+            await self.api_limiter.wait_async()
+            success, result, message_id = await self.send_telegram_message(content, channel)
+            if result == self.TELEGRAM_UNAVAILABLE:
+                # Вызов отклонен circuit breaker без обращения к API: попытка не считается
+                break
+
+            def update(conn, row_id=row_id, attempts=attempts, success=success, result=result):
+                if success or attempts + 1 >= self.OUTBOUND_MAX_ATTEMPTS:
+                    conn.execute('DELETE FROM outbound_queue WHERE id = ?', (row_id,))
                 else:
-                    return False, f"❌ HTTP error: {response.status_code}"
-                    
+                    conn.execute('''
+                        UPDATE outbound_queue SET attempts = attempts + 1, last_error = ? WHERE id = ?
+                    ''', (result, row_id))
+
+            await self.db.run(update)
+
+            if success:
+                await self._record_sent_message(channel, post_type, day, message_id)
+                await self._log_posting(post_type, content, trigger, day, channel=channel, message_id=message_id)
+                await self._update_stats()
+                logger.info(f"Отложенный пост {post_type} (день {day}) отправлен в {channel}")
+            elif attempts + 1 >= self.OUTBOUND_MAX_ATTEMPTS:
+                await self._log_posting(post_type, content, trigger, day, status='failed', channel=channel)
+                logger.error(f"Отложенный пост {post_type} для {channel} отброшен после "
+                             f"{self.OUTBOUND_MAX_ATTEMPTS} попыток: {result}")
+
+    def schedule_custom_post(self, text: str, due_at: datetime, recurrence: str = None, channels=None,
+                             ends_at: datetime = None):
+        """Отложенный произвольный пост: разовый или с повтором (CUSTOM_RECURRENCES).
+
+        due_at и ends_at - aware datetime; channels - подмножество каналов
+        (по умолчанию все). Возвращает id записи в custom_posts.
+        """
+        issues = []
+        _lint_html_message(text, {}, issues)
+        if issues:
+            raise ValueError(f"Текст не пройдет проверку Telegram: {issues[0]['message']}")
+        if recurrence and recurrence not in self.CUSTOM_RECURRENCES:
+            raise ValueError(f"recurrence должен быть одним из: {', '.join(self.CUSTOM_RECURRENCES)}")
+        unknown = set(channels or []) - set(self.channel_ids)
+        if unknown:
+            raise ValueError(f"Неизвестные каналы: {', '.join(sorted(unknown))}")
+        now = self.clock(pytz.utc)
+        if due_at < now - timedelta(seconds=self.MISFIRE_GRACE_SECONDS):
+            raise ValueError("Время отправки уже прошло")
+        if ends_at and ends_at < due_at:
+            raise ValueError("Окончание повторов раньше первой отправки")
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            cursor = conn.execute('''
+                INSERT INTO custom_posts (text, channels, due_at, recurrence, ends_at, status, created_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', ?)
+            ''', (
+                text,
+                ','.join(channels) if channels else None,
+                self._utc_key(due_at),
+                recurrence,
+                self._utc_key(ends_at) if ends_at else None,
+                self._utc_key(now)
+            ))
+            conn.commit()
+            post_id = cursor.lastrowid
+        finally:
+            conn.close()
+        logger.info(f"Произвольный пост #{post_id} запланирован на {due_at.astimezone(self.target_tz)}"
+                    f"{f' (повтор: {recurrence})' if recurrence else ''}")
+        return post_id
+
+    def list_custom_posts(self, status: str = None, limit: int = 100):
+        """Запланированные произвольные посты (ближайшие первыми)"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            if status:
+                rows = conn.execute('SELECT * FROM custom_posts WHERE status = ? ORDER BY due_at LIMIT ?',
+                                    (status, limit)).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM custom_posts ORDER BY due_at DESC LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def cancel_custom_post(self, post_id: int):
+        """Отмена запланированного поста; False - поста нет или он уже не ожидает отправки"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            cursor = conn.execute("UPDATE custom_posts SET status = 'cancelled' WHERE id = ? AND status = 'pending'",
+                                  (post_id,))
+            conn.commit()
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def dispatch_custom_posts(self):
+        """Отправка наступивших произвольных постов (задание планировщика)"""
+        try:
+            with delivery_lane('scheduled'):
+                self.runtime.run(self._dispatch_custom_posts_async())
         except Exception as e:
-            return False, f"❌ Connection error: {str(e)}"
+            logger.error(f"Error dispatching custom posts: {e}")
+
+    async def _dispatch_custom_posts_async(self, batch_size: int = 100):
+        now = self.clock(pytz.utc)
+        rows = await self.db.run(lambda conn: conn.execute('''
+            SELECT id, text, channels, due_at, recurrence, ends_at FROM custom_posts
+            WHERE status = 'pending' AND due_at <= ? ORDER BY due_at LIMIT ?
+        ''', (self._utc_key(now), batch_size)).fetchall())
+
+        for post_id, text, channels, due_at, recurrence, ends_at in rows:
+            due = datetime.fromisoformat(due_at)
+            next_due = self._next_custom_due(due, recurrence, now) if recurrence else None
+            if next_due and ends_at and self._utc_key(next_due) > ends_at:
+                next_due = None
+            stale = now - due > timedelta(hours=self.catchup_window_hours)
+
+            # Сдвиг due_at (или смена статуса) по сравнению со старым значением:
+            # при нескольких процессах пост отправит только один
+            claimed = await self.db.run(lambda conn, params: conn.execute('''
+                UPDATE custom_posts SET status = ?, due_at = ?
+                WHERE id = ? AND status = 'pending' AND due_at = ?
+            ''', params).rowcount == 1, (
+                'pending' if next_due else ('expired' if stale else 'sending'),
+                self._utc_key(next_due) if next_due else due_at,
+                post_id,
+                due_at
+            ))
+            if not claimed:
+                continue
+            if stale:
+                logger.warning(f"Произвольный пост #{post_id} на {due_at} устарел и не отправлен")
+                continue
+
+            with tracer.span('custom_post', post_id=post_id, recurrence=recurrence):
+                success, result = await self._deliver(
+                    'custom', self.get_current_day(), 'scheduled', text,
+                    channels=channels.split(',') if channels else None
+                )
+            await self.db.run(lambda conn, params: conn.execute('''
+                UPDATE custom_posts SET last_sent_at = ?, last_result = ?,
+                    status = CASE WHEN status = 'sending' THEN ? ELSE status END
+                WHERE id = ?
+            ''', params), (self._utc_key(now), result, 'sent' if success else 'failed', post_id))
+            logger.info(f"Произвольный пост #{post_id}: {result}")
+
+    def _next_custom_due(self, due: datetime, recurrence: str, now: datetime):
+        """Следующий после now повтор (то же местное время TARGET_TIMEZONE)"""
+        step = timedelta(days=self.CUSTOM_RECURRENCES[recurrence])
+        local = due.astimezone(self.target_tz).replace(tzinfo=None)
+        while True:
+            local += step
+            moment = self.target_tz.localize(local)
+            if moment > now:
+                return moment
+
+    @staticmethod
+    def _utc_key(moment: datetime):
+        """Время в UTC строкой фиксированного формата (сравнимой в SQL)"""
+        return moment.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+    async def _record_sent_message(self, channel: str, post_type: str, day: int, message_id: int):
+        """Сохранение message_id отправленного поста для последующих исправлений"""
+        sent_at = self.clock(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            await self.db.run(lambda conn: conn.execute('''
+                INSERT INTO sent_messages (channel, post_type, day, message_id, sent_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (channel, post_type, day, message_id, sent_at)))
+        except Exception as e:
+            logger.error(f"Error recording sent message: {e}")
 
-    def _log_posting(self, post_type: str, content: str, trigger: str, day: int):
-        """Логирование публикации с указанием дня"""
+    def find_sent_messages(self, post_type: str, day: int, channels=None, sent_after: datetime = None):
+        """Неудаленные сообщения поста (post_type, day), по всем или выбранным каналам.
+
+        Тот же день контента повторяется каждый цикл, поэтому по умолчанию
+        берется только последняя отправка в каждый канал; sent_after - все
+        отправки не раньше этого момента.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
         try:
-            conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
+            if sent_after is None:
+                rows = conn.execute('''
+                    SELECT id, channel, message_id FROM sent_messages
+                    WHERE id IN (
+                        SELECT MAX(id) FROM sent_messages WHERE post_type = ? AND day = ? GROUP BY channel
+                    ) AND state != 'deleted'
+                    ORDER BY id
+                ''', (post_type, day)).fetchall()
+            else:
+                rows = conn.execute('''
+                    SELECT id, channel, message_id FROM sent_messages
+                    WHERE post_type = ? AND day = ? AND state != 'deleted' AND sent_at >= ?
+                    ORDER BY id
+                ''', (post_type, day, sent_after.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S'))).fetchall()
+        finally:
+            conn.close()
+        return [{'record_id': record_id, 'channel': channel, 'message_id': message_id}
+                for record_id, channel, message_id in rows
+                if not channels or channel in channels]
+
+    async def _mark_sent_message(self, record_id: int, state: str):
+        await self.db.run(lambda conn: conn.execute('''
+            UPDATE sent_messages SET state = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (state, record_id)))
+
+    def start_correction(self, post_type: str, day: int, action: str, text: str = None, channels=None,
+                         sent_after: datetime = None):
+        """Фоновое исправление (edit) или удаление (delete) поста во всех каналах.
+
+        Затрагивается последняя отправка в каждый канал или, с sent_after,
+        все отправки начиная с этого момента (см. find_sent_messages).
+
+        Для edit без text берется текущий контент (post_type, day) - так
+        исправление в контенте распространяется на уже отправленные посты.
+        Возвращает (job_id, число сообщений).
+        """
+        if action not in ('edit', 'delete'):
+            raise ValueError("action должен быть edit или delete")
+        if action == 'edit' and not text and not self._get_content_by_type(post_type, day):
+            raise ValueError(f"Контент для {post_type} (день {day}) не найден")
+
+        messages = self.find_sent_messages(post_type, day, channels, sent_after)
+
+        async def correct(item):
+            if action == 'edit':
+                # Без явного текста - актуальный контент с учетом переопределений канала
+                new_text = text or self._get_content_by_type(post_type, day, item['channel'])
+                success, result = await self.edit_telegram_message(item['channel'], item['message_id'], new_text)
+            else:
+                success, result = await self.delete_telegram_message(item['channel'], item['message_id'])
+            if success:
+                await self._mark_sent_message(item['record_id'], 'edited' if action == 'edit' else 'deleted')
+            return success, result
+
+        job_id = self.jobs.start(
+            correct,
+            messages,
+            name=f"{'Исправление' if action == 'edit' else 'Удаление'} {post_type} день {day}",
+            concurrency=int(os.getenv('CORRECTION_CONCURRENCY', '10')),
+            rate_limiter=self.api_limiter
+        )
+        return job_id, len(messages)
+
+    @traced()
+    async def _log_posting(self, post_type: str, content: str, trigger: str, day: int, status: str = 'success',
+                           channel: str = None, message_id: int = None):
+        """Логирование публикации с указанием дня"""
+        channel = channel or self.channel_id
+        now = self.clock(pytz.utc)
+        trace_id = current_trace_id()
+
+        def write(conn):
             cursor = conn.cursor()
-            
             cursor.execute('''
-                INSERT INTO posting_logs (post_type, content, status, message)
-                VALUES (?, ?, ?, ?)
-            ''', (post_type, f"День {day}: {str(content)[:150]}...", 'success', f"{trigger}"))
-            
-            conn.commit()
-            conn.close()
+                INSERT INTO posting_logs (post_type, content, status, message, channel, message_id, actual_time,
+                                          trace_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (post_type, f"День {day}: {str(content)[:150]}...", status, f"{trigger}", channel, message_id,
+                  now.strftime('%Y-%m-%d %H:%M:%S'), trace_id))
+            self._update_rollups(cursor, channel, post_type, trigger, status, now)
+
+        try:
+            await self.db.run(write)
         except Exception as e:
             logger.error(f"Error logging: {e}")
 
-    def _update_stats(self):
-        """Обновление статистики"""
+    def _update_rollups(self, cursor, channel: str, post_type: str, trigger: str, status: str,
+                        timestamp: datetime, count: int = 1):
+        """Инкремент часового и дневного агрегатов в текущей транзакции"""
+        local_time = timestamp.astimezone(self.target_tz)
+        buckets = {
+            'posting_stats_hourly': local_time.strftime('%Y-%m-%d %H:00'),
+            'posting_stats_daily': local_time.strftime('%Y-%m-%d')
+        }
+        for table, bucket in buckets.items():
+            cursor.execute(f'''
+                INSERT INTO {table} (bucket, channel, post_type, trigger, status, count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket, channel, post_type, trigger, status)
+                DO UPDATE SET count = count + excluded.count
+            ''', (bucket, channel, post_type, trigger, status, count))
+
+    def _backfill_rollups(self, cursor):
+        """Однократное построение агрегатов по уже накопленным posting_logs"""
+        cursor.execute('SELECT actual_time, post_type, message, status, channel FROM posting_logs')
+        rows = cursor.fetchall()
+        for actual_time, post_type, trigger, status, channel in rows:
+            if not actual_time:
+                continue
+            # CURRENT_TIMESTAMP в SQLite - время UTC
+            timestamp = pytz.utc.localize(datetime.strptime(actual_time.split('.')[0], '%Y-%m-%d %H:%M:%S'))
+            self._update_rollups(cursor, channel or self.channel_id, post_type, trigger, status, timestamp)
+        if rows:
+            logger.info(f"Агрегаты статистики построены по {len(rows)} записям журнала")
+
+    # Допустимые измерения группировки для /api/stats
+    STATS_DIMENSIONS = ('channel', 'post_type', 'trigger', 'status')
+
+    def query_stats(self, date_from: str, date_to: str, group_by):
+        """Агрегированная статистика за период [date_from, date_to] (даты YYYY-MM-DD).
+
+        group_by - список из 'hour', 'day' и измерений STATS_DIMENSIONS.
+        """
+        unknown = [key for key in group_by if key not in ('hour', 'day') + self.STATS_DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля группировки: {', '.join(unknown)}")
+
+        hourly = 'hour' in group_by
+        table = 'posting_stats_hourly' if hourly else 'posting_stats_daily'
+        columns = [key for key in group_by if key in self.STATS_DIMENSIONS]
+        if hourly or 'day' in group_by:
+            columns.insert(0, 'bucket')
+        # Верхняя граница включительно: следующий день после date_to
+        upper = (datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+        select = ', '.join(columns + ['SUM(count)'])
+        group = f"GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}" if columns else ''
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
         try:
-            conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('UPDATE bot_stats SET posts_sent = posts_sent + 1, last_activity = CURRENT_TIMESTAMP')
-            conn.commit()
+            rows = conn.execute(
+                f'SELECT {select} FROM {table} WHERE bucket >= ? AND bucket < ? {group}',
+                (date_from, upper)
+            ).fetchall()
+            totals = dict(conn.execute(
+                'SELECT status, SUM(count) FROM posting_stats_daily WHERE bucket >= ? AND bucket < ? GROUP BY status',
+                (date_from, upper)
+            ).fetchall())
+        finally:
+            conn.close()
+
+        names = [('hour' if hourly else 'day') if column == 'bucket' else column for column in columns]
+        total = sum(totals.values())
+        return {
+            'from': date_from,
+            'to': date_to,
+            'group_by': list(group_by),
+            'rows': [dict(zip(names + ['count'], row)) for row in rows if row[-1] is not None],
+            'totals': {
+                'posts': total,
+                'by_status': totals,
+                'failure_rate': round(totals.get('failed', 0) / total, 4) if total else 0.0
+            }
+        }
+
+    # Поля выгрузки журнала публикаций (/export/logs)
+    EXPORT_COLUMNS = ('id', 'actual_time', 'channel', 'message_id', 'post_type', 'trigger', 'status', 'content',
+                      'trace_id')
+
+    def iter_posting_logs(self, date_from: str = None, date_to: str = None, batch_size: int = 500):
+        """Построчный обход posting_logs пачками по id.
+
+        Каждая пачка читается отдельным коротким запросом, поэтому выгрузка
+        не держит блокировку БД и не мешает _log_posting.
+        """
+        conditions, params = ['id > ?'], []
+        if date_from:
+            conditions.append('actual_time >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('actual_time < ?')
+            params.append((datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+        sql = f'''
+            SELECT id, actual_time, channel, message_id, post_type, message, status, content, trace_id
+            FROM posting_logs
+            WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?
+        '''
+
+        last_id = 0
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            while True:
+                rows = conn.execute(sql, [last_id] + params + [batch_size]).fetchall()
+                for row in rows:
+                    yield dict(zip(self.EXPORT_COLUMNS, row))
+                if len(rows) < batch_size:
+                    break
+                last_id = rows[-1][0]
+        finally:
             conn.close()
+
+    @traced()
+    async def _update_stats(self):
+        """Обновление статистики"""
+        try:
+            await self.db.run(lambda conn: conn.execute(
+                'UPDATE bot_stats SET posts_sent = posts_sent + 1, last_activity = CURRENT_TIMESTAMP'
+            ))
         except Exception as e:
             logger.error(f"Error updating stats: {e}")
 
+    def backup_database(self):
+        """Плановая онлайн-копия БД с ротацией снимков"""
+        self.backup_metrics['total_runs'] += 1
+        try:
+            metrics = backup_sqlite(
+                self.db_path,
+                self.backup_dir,
+                keep=int(os.getenv('BACKUP_KEEP', '7')),
+                pages_per_step=int(os.getenv('BACKUP_PAGES_PER_STEP', '64'))
+            )
+            self.backup_metrics['last'] = metrics
+            logger.info(f"Резервная копия {metrics['path']}: {metrics['size_bytes']} байт "
+                        f"({metrics['compressed_bytes']} сжато) за {metrics['duration_ms']} мс")
+            return metrics
+        except Exception as e:
+            self.backup_metrics['failures'] += 1
+            logger.error(f"Error backing up database: {e}")
+            return None
+
     def get_stats(self):
         """Получение статистики"""
         try:
-            conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
             cursor = conn.cursor()
             
             cursor.execute('SELECT posts_sent FROM bot_stats')
@@ -1432,8 +4104,9 @@ class SafetyContentManager:
             
             cursor.execute('SELECT * FROM posting_logs ORDER BY id DESC LIMIT 10')
             recent_logs = [{
+                'id': row[0],
                 'timestamp': row[3].split('.')[0] if row[3] else 'N/A',
-                'message': f"{row[1]}: {row[5]}"
+                'message': f"{row[1]}: {row[5]}" + ("" if row[4] == 'success' else f" ❌ {row[4]}")
             } for row in cursor.fetchall()]
             
             conn.close()
@@ -1446,20 +4119,121 @@ class SafetyContentManager:
             logger.error(f"Error getting stats: {e}")
             return {'posts_sent': 0, 'recent_logs': []}
 
+    def get_dashboard_state(self):
+        """Снимок данных дашборда для рассылки изменений по SSE"""
+        stats = self.get_stats()
+        return {
+            'posts_sent': stats['posts_sent'],
+            'channel_status': getattr(self, 'channel_status', 'Не проверен'),
+            'current_day': self.get_current_day(),
+            'jobs': self.get_scheduled_jobs(),
+            'logs': stats['recent_logs'],
+            'breaker_state': self.telegram_breaker.state,
+            'breaker_trips': self.telegram_breaker.trips,
+            'outbound_pending': self.outbound_pending()
+        }
+
+    def preview_schedule(self, days: int, channels=None):
+        """Плановые посты на days дней вперед: время, тип, день контента и заголовок.
+
+        Все слоты периода строятся одним проходом по SCHEDULE_SLOTS; номер дня
+        для слота вычисляется по его дате от одной прочитанной опорной точки цикла.
+        В плане только слоты планировщика: weekly_task, weekly_poll и
+        express_test отправляются лишь вручную и в план не попадают.
+        """
+        now = self.clock(self.server_tz)
+        horizon = now + timedelta(days=days)
+        today = now.astimezone(self.target_tz).date()
+        anchor = self._day_anchor()
+
+        slots = []
+        for offset in range(days + 1):
+            date = today + timedelta(days=offset)
+            for time_str, (post_type, name) in self.SCHEDULE_SLOTS.items():
+                slot_time = self.target_tz.localize(
+                    datetime.combine(date, datetime.strptime(time_str, '%H:%M').time())
+                )
+                if not now < slot_time <= horizon:
+                    continue
+                slots.append((slot_time, post_type, name, self.day_index_for(date, anchor)))
+        slots.sort(key=lambda slot: slot[0])
+
+        titles = {}
+        timeline = {}
+        for channel in channels or self.channel_ids:
+            entries = []
+            for slot_time, post_type, name, slot_index in slots:
+                day = self._scheduled_day(post_type, channel, slot_index)
+                content = self._get_content_by_type(post_type, day, channel) if day else None
+                if content not in titles:
+                    titles[content] = content_title(content) if content else None
+                entries.append({
+                    'datetime': slot_time.isoformat(),
+                    'post_type': post_type,
+                    'name': name,
+                    'day': day,
+                    'title': titles[content]
+                })
+            timeline[channel] = entries
+
+        return {
+            'generated_at': now.isoformat(),
+            'days': days,
+            'rotation': self.content_rotation,
+            'scheduler_running': self.scheduler_running,
+            'channels': timeline
+        }
+
     def get_scheduled_jobs(self):
         """Получение списка запланированных заданий"""
         jobs = []
         if hasattr(self, 'scheduler'):
             for job in self.scheduler.get_jobs():
                 jobs.append({
+                    'id': job.id,
                     'name': job.name,
-                    'next_run': job.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if job.next_run_time else 'N/A'
+                    'next_run': job.next_run_time.strftime('%Y-%m-%d %H:%M:%S')
+                                if getattr(job, 'next_run_time', None) else 'N/A'
                 })
         return jobs
 
+    def _acquire_scheduler_lock(self):
+        """Эксклюзивная блокировка SCHEDULER_LOCK_FILE; False - планировщик уже работает в другом процессе"""
+        if fcntl is None or self._scheduler_lock is not None:
+            return True
+        lock_file = open(self.scheduler_lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._scheduler_lock = lock_file
+        return True
+
+    def _release_scheduler_lock(self):
+        """Освобождение блокировки: планировщик сможет запустить другой процесс"""
+        if self._scheduler_lock is not None:
+            fcntl.flock(self._scheduler_lock, fcntl.LOCK_UN)
+            self._scheduler_lock.close()
+            self._scheduler_lock = None
+
+    def scheduler_running_elsewhere(self):
+        """Держит ли блокировку планировщика другой процесс (пробный захват без ожидания)"""
+        if fcntl is None or self._scheduler_lock is not None:
+            return False
+        try:
+            with open(self.scheduler_lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+        except OSError:
+            return True
+
     def start_scheduler(self):
         """Запуск планировщика"""
         if not self.scheduler_running:
+            if not self._acquire_scheduler_lock():
+                raise RuntimeError("планировщик уже работает в другом процессе")
             self.scheduler.start()
             self.scheduler_running = True
             return True
@@ -1470,6 +4244,7 @@ class SafetyContentManager:
         if self.scheduler_running:
             self.scheduler.shutdown()
             self.scheduler_running = False
+            self._release_scheduler_lock()
             return True
         return False
 
@@ -1479,15 +4254,676 @@ class SafetyContentManager:
             health_url = os.getenv('HEALTH_CHECK_URL', '')
             if health_url:
                 requests.get(health_url, timeout=10)
-            logger.info("Keep-alive ping sent")
+            keep_alive_logger.info("Keep-alive ping sent")
         except Exception as e:
             logger.warning(f"Keep-alive error: {e}")
 
-# Глобальный экземпляр
-safety_manager = SafetyContentManager()
+# ==================== BACKUP ====================
+
+BACKUP_PREFIX = 'safety_bot-'
+BACKUP_SUFFIX = '.db.gz'
+
+
+def list_backups(backup_dir: str):
+    """Снимки БД в каталоге, от новых к старым"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir)
+             if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def backup_sqlite(db_path: str, backup_dir: str, keep: int = 7, pages_per_step: int = 64):
+    """Онлайн-копия БД через SQLite backup API со сжатием и ротацией.
+
+    Копирование идет порциями по pages_per_step страниц с паузой между
+    ними, поэтому писатели не блокируются на все время копирования.
+    Возвращает метрики снимка.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    started = time.monotonic()
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    raw_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}.db.tmp")
+    snapshot_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}{BACKUP_SUFFIX}")
+    steps = [0]
+
+    def progress(status, remaining, total):
+        steps[0] += 1
+
+    source = sqlite3.connect(db_path, check_same_thread=False)
+    target = sqlite3.connect(raw_path)
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress, sleep=0.01)
+        page_count = target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        with open(raw_path, 'rb') as raw, gzip.open(snapshot_path + '.tmp', 'wb') as compressed:
+            shutil.copyfileobj(raw, compressed)
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        size_bytes = os.path.getsize(raw_path)
+    finally:
+        os.remove(raw_path)
+
+    for old_snapshot in list_backups(backup_dir)[keep:]:
+        os.remove(old_snapshot)
+
+    return {
+        'path': snapshot_path,
+        'finished_at': datetime.now().isoformat(),
+        'duration_ms': round((time.monotonic() - started) * 1000, 1),
+        'size_bytes': size_bytes,
+        'compressed_bytes': os.path.getsize(snapshot_path),
+        'pages': page_count,
+        'steps': steps[0]
+    }
+
+
+def restore_sqlite(snapshot_path: str, db_path: str):
+    """Восстановление БД из сжатого снимка (с проверкой целостности)"""
+    raw_path = db_path + '.restore.tmp'
+    with gzip.open(snapshot_path, 'rb') as compressed, open(raw_path, 'wb') as raw:
+        shutil.copyfileobj(compressed, raw)
+    try:
+        source = sqlite3.connect(raw_path)
+        try:
+            result = source.execute('PRAGMA integrity_check').fetchone()[0]
+            if result != 'ok':
+                raise ValueError(f"снимок поврежден: {result}")
+            target = sqlite3.connect(db_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    finally:
+        os.remove(raw_path)
+
+
+def cli_restore_backup(argv):
+    """python app.py restore-backup [SNAPSHOT] [--list]"""
+    parser = argparse.ArgumentParser(prog='app.py restore-backup',
+                                     description='Восстановление safety_bot.db из снимка')
+    parser.add_argument('snapshot', nargs='?', help='файл снимка (по умолчанию самый свежий)')
+    parser.add_argument('--backup-dir', default=os.getenv('BACKUP_DIR', 'backups'))
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'safety_bot.db'))
+    parser.add_argument('--list', action='store_true', help='показать доступные снимки')
+    args = parser.parse_args(argv)
+
+    snapshots = list_backups(args.backup_dir)
+    if args.list:
+        for path in snapshots:
+            print(f"{path}\t{os.path.getsize(path)} байт")
+        return 0
+
+    snapshot = args.snapshot or (snapshots[0] if snapshots else None)
+    if not snapshot:
+        print(f"Снимки в {args.backup_dir} не найдены")
+        return 1
+    restore_sqlite(snapshot, args.db)
+    print(f"✅ {args.db} восстановлена из {snapshot}")
+    return 0
+
+
+# ==================== SIMULATION ====================
+
+class VirtualClock:
+    """Управляемые часы: замена datetime.now для симуляции"""
+
+    def __init__(self, start: datetime):
+        self.current = start
+
+    def __call__(self, tz=None):
+        if tz is None:
+            # Как datetime.now(): наивное локальное время
+            return self.current.astimezone().replace(tzinfo=None)
+        return self.current.astimezone(tz)
+
+    def advance_to(self, moment: datetime):
+        self.current = moment
+
+
+class FakeTelegramSender:
+    """Имитация Bot API: фиксирует каждое сообщение с виртуальным временем"""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.sent = []
+        self._message_ids = {}
+
+    async def __call__(self, method: str, payload: dict):
+        chat_id = payload.get('chat_id')
+        if method != 'sendMessage':
+            return True, {'title': f"Simulated {chat_id}"} if method == 'getChat' else True
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        self.sent.append({'time': self.clock.current, 'channel': chat_id, 'text': payload['text']})
+        return True, {'message_id': message_id}
+
+
+# Задания планировщика, которые участвуют в симуляции
+SIMULATED_JOB_PREFIXES = ('auto_',)
+
+
+def run_simulation(days: int, start: datetime, report_path: str = None):
+    """Прогон планировщика, выбора контента и доставки на виртуальном времени.
+
+    Используются настоящие триггеры заданий из setup_scheduler (с переводом
+    часовых поясов), но время сдвигается мгновенно от срабатывания к
+    срабатыванию. Отправка идет в FakeTelegramSender, БД - временная,
+    трассировка на время прогона отключена.
+    """
+    clock = VirtualClock(start)
+    sender = FakeTelegramSender(clock)
+    workdir = tempfile.mkdtemp(prefix='safety_sim_')
+    # Спаны виртуальных отправок не должны попадать в файл трассировки процесса
+    tracing, tracer.enabled = tracer.enabled, False
+    try:
+        manager = SafetyContentManager(
+            db_path=os.path.join(workdir, 'simulation.db'),
+            clock=clock,
+            telegram_api=sender,
+            start_services=False
+        )
+        manager.api_limiter = PriorityRateLimiter(0)
+
+        jobs = [job for job in manager.scheduler.get_jobs() if job.id.startswith(SIMULATED_JOB_PREFIXES)]
+        end = start + timedelta(days=days)
+        next_fire = {job.id: job.trigger.get_next_fire_time(None, start) for job in jobs}
+        slot_log = []
+
+        started = time.perf_counter()
+        while True:
+            job = min(jobs, key=lambda candidate: next_fire[candidate.id] or end)
+            fire_time = next_fire[job.id]
+            if fire_time is None or fire_time >= end:
+                break
+            clock.advance_to(fire_time)
+            posts_before = len(sender.sent)
+            job.func(*job.args)
+            if job.id.startswith('auto_'):
+                slot_log.append({'time': fire_time, 'post_type': job.args[0],
+                                 'delivered': len(sender.sent) - posts_before})
+            next_fire[job.id] = job.trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+        elapsed = time.perf_counter() - started
+
+        report = _simulation_report(manager, sender, slot_log, start, end, elapsed)
+    finally:
+        tracer.enabled = tracing
+        shutil.rmtree(workdir, ignore_errors=True)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    return report
+
+
+def _simulation_report(manager, sender, slot_log, start, end, elapsed):
+    """Сводка симуляции: посты, пропуски, дубли и повторы контента"""
+    channels = manager.channel_ids
+    local_days = []
+    day = start.astimezone(manager.target_tz).date()
+    while day < end.astimezone(manager.target_tz).date():
+        local_days.append(day)
+        day += timedelta(days=1)
+
+    posted = {}
+    last_seen = {}
+    repeat_gaps = {}
+    for post in sender.sent:
+        local_time = post['time'].astimezone(manager.target_tz)
+        slot_type = next((slot['post_type'] for slot in reversed(slot_log) if slot['time'] == post['time']), None)
+        key = (post['channel'], slot_type)
+        posted.setdefault(key, []).append(local_time.date())
+        # Интервал (в днях) до предыдущего показа того же текста в канале
+        text_key = (post['channel'], slot_type, post['text'])
+        if text_key in last_seen:
+            gap = (local_time.date() - last_seen[text_key]).days
+            repeat_gaps.setdefault(slot_type, []).append(gap)
+        last_seen[text_key] = local_time.date()
+
+    gaps, duplicates = [], []
+    for channel in channels:
+        for post_type, _ in manager.SCHEDULE_SLOTS.values():
+            dates = posted.get((channel, post_type), [])
+            counts = {}
+            for date in dates:
+                counts[date] = counts.get(date, 0) + 1
+            for date in local_days:
+                slot_time = min(time_str for time_str, (slot_type, _) in manager.SCHEDULE_SLOTS.items()
+                                if slot_type == post_type)
+                slot_moment = manager.target_tz.localize(
+                    datetime.combine(date, datetime.strptime(slot_time, '%H:%M').time())
+                )
+                if start <= slot_moment < end and counts.get(date, 0) == 0:
+                    gaps.append({'channel': channel, 'post_type': post_type, 'date': date.isoformat()})
+            duplicates.extend({'channel': channel, 'post_type': post_type, 'date': date.isoformat(), 'count': count}
+                              for date, count in counts.items() if count > 1)
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'rotation': manager.content_rotation,
+        'channels': channels,
+        'slots_fired': len(slot_log),
+        'posts': len(sender.sent),
+        'posts_by_type': {post_type: sum(len(dates) for (_, slot_type), dates in posted.items()
+                                         if slot_type == post_type)
+                          for post_type, _ in manager.SCHEDULE_SLOTS.values()},
+        'gaps': gaps,
+        'duplicates': duplicates,
+        'min_repeat_interval_days': {post_type: min(intervals) for post_type, intervals in repeat_gaps.items()},
+        'final_day': manager.get_current_day(),
+        'final_day_index': manager.get_day_index(),
+        'benchmark': {
+            'wall_seconds': round(elapsed, 3),
+            'virtual_days_per_second': round((end - start).days / elapsed, 1) if elapsed else None,
+            'posts_per_second': round(len(sender.sent) / elapsed, 1) if elapsed else None
+        },
+        'timeline': [{
+            'time': post['time'].astimezone(manager.target_tz).isoformat(),
+            'channel': post['channel'],
+            'title': content_title(post['text'])
+        } for post in sender.sent]
+    }
+
+
+def cli_simulate(argv):
+    """python app.py simulate [--days 365] [--start YYYY-MM-DD] [--channels @a,@b] [--rotation pool]"""
+    parser = argparse.ArgumentParser(prog='app.py simulate',
+                                     description='Симуляция планировщика на виртуальном времени')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--start', help='дата начала (по умолчанию сегодня), полночь SERVER_TIMEZONE')
+    parser.add_argument('--channels', default=os.getenv('TELEGRAM_CHANNEL_ID') or '@simulation')
+    parser.add_argument('--rotation', choices=('cycle', 'pool'), default=os.getenv('CONTENT_ROTATION', 'cycle'))
+    parser.add_argument('--report', default='simulation_report.json')
+    args = parser.parse_args(argv)
+
+    # Настройки симуляции действуют только внутри этого процесса
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'simulation')
+    os.environ['TELEGRAM_CHANNEL_ID'] = args.channels
+    os.environ['CONTENT_ROTATION'] = args.rotation
+    server_tz = pytz.timezone(os.getenv('SERVER_TIMEZONE', 'UTC'))
+    start_date = datetime.strptime(args.start, '%Y-%m-%d') if args.start else datetime.now()
+    start = server_tz.localize(datetime.combine(start_date.date(), datetime.min.time()))
+
+    report = run_simulation(args.days, start, args.report)
+    print(f"Слотов: {report['slots_fired']}, постов: {report['posts']}, пропусков: {len(report['gaps'])}, "
+          f"дублей: {len(report['duplicates'])}")
+    print(f"Мин. интервал повтора (дни): {report['min_repeat_interval_days']}")
+    benchmark = report['benchmark']
+    print(f"{benchmark['wall_seconds']} с, {benchmark['virtual_days_per_second']} вирт. дней/с, "
+          f"{benchmark['posts_per_second']} постов/с. Отчет: {args.report}")
+    return 1 if report['gaps'] or report['duplicates'] else 0
+
+
+# ==================== CONTENT LINT ====================
+
+# Ограничения Telegram Bot API (длины в UTF-16 code units)
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_POLL_QUESTION_LIMIT = 300
+TELEGRAM_POLL_OPTION_LIMIT = 100
+TELEGRAM_POLL_MIN_OPTIONS = 2
+TELEGRAM_POLL_MAX_OPTIONS = 10
+
+# Подмножество HTML, которое принимает parse_mode=HTML, и допустимые атрибуты
+TELEGRAM_HTML_TAGS = {
+    'b': set(), 'strong': set(), 'i': set(), 'em': set(),
+    'u': set(), 'ins': set(), 's': set(), 'strike': set(), 'del': set(),
+    'span': {'class'}, 'tg-spoiler': set(), 'a': {'href'},
+    'tg-emoji': {'emoji-id'}, 'code': {'class'}, 'pre': set(),
+    'blockquote': {'expandable'}
+}
+TELEGRAM_HTML_ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"'}
+
+
+def utf16_len(text: str) -> int:
+    """Длина строки в UTF-16 code units (так считает Telegram)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class TelegramHTMLValidator(HTMLParser):
+    """Проверка текста на соответствие HTML-разметке Telegram"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.errors = []
+        self.stack = []
+        self.plain_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in TELEGRAM_HTML_TAGS:
+            self.errors.append(f"неподдерживаемый тег <{tag}>")
+            return
+        for name, value in attrs:
+            if name not in TELEGRAM_HTML_TAGS[tag]:
+                self.errors.append(f"неподдерживаемый атрибут {name} в <{tag}>")
+            elif tag == 'span' and value != 'tg-spoiler':
+                self.errors.append("<span> допускается только с class=\"tg-spoiler\"")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in TELEGRAM_HTML_TAGS:
+            self.errors.append(f"неподдерживаемый тег </{tag}>")
+        elif not self.stack or self.stack[-1] != tag:
+            expected = f"</{self.stack[-1]}>" if self.stack else "нет открытого тега"
+            self.errors.append(f"лишний или перекрестный </{tag}> (ожидался {expected})")
+        else:
+            self.stack.pop()
+
+    def handle_data(self, data):
+        if '<' in data or '&' in data:
+            self.errors.append("неэкранированный символ '<' или '&' (используйте &lt; / &amp;)")
+        self.plain_parts.append(data)
+
+    def handle_entityref(self, name):
+        if name not in TELEGRAM_HTML_ENTITIES:
+            self.errors.append(f"неподдерживаемая сущность &{name};")
+        self.plain_parts.append(TELEGRAM_HTML_ENTITIES.get(name, ''))
+
+    def handle_charref(self, name):
+        try:
+            code = int(name[1:], 16) if name[:1] in ('x', 'X') else int(name)
+            self.plain_parts.append(chr(code))
+        except (ValueError, OverflowError):
+            self.errors.append(f"некорректная ссылка &#{name};")
+
+    def handle_comment(self, data):
+        self.errors.append("HTML-комментарии не поддерживаются")
+
+    def validate(self, text: str):
+        """Возвращает (ошибки, текст без разметки)"""
+        self.feed(text)
+        self.close()
+        for tag in reversed(self.stack):
+            self.errors.append(f"незакрытый тег <{tag}>")
+        return self.errors, ''.join(self.plain_parts)
+
+
+def content_title(text: str) -> str:
+    """Первая непустая строка поста без HTML-разметки"""
+    _, plain = TelegramHTMLValidator().validate(text)
+    return next((line.strip() for line in plain.splitlines() if line.strip()), '')
+
+
+def _lint_html_message(text, location, issues):
+    """Проверка текста, отправляемого через sendMessage с parse_mode=HTML"""
+    if not isinstance(text, str) or not text.strip():
+        issues.append(dict(location, level='error', code='empty', message="пустой текст"))
+        return
+    errors, plain = TelegramHTMLValidator().validate(text)
+    for error in errors:
+        issues.append(dict(location, level='error', code='html', message=error))
+    length = utf16_len(plain)
+    if length > TELEGRAM_MESSAGE_LIMIT:
+        issues.append(dict(location, level='error', code='too_long',
+                           message=f"{length} UTF-16 символов > {TELEGRAM_MESSAGE_LIMIT}"))
+
+
+def _lint_poll(entry, location, issues):
+    """Проверка вопроса и вариантов ответа на лимиты sendPoll"""
+    options = entry.get('options') or []
+    if not TELEGRAM_POLL_MIN_OPTIONS <= len(options) <= TELEGRAM_POLL_MAX_OPTIONS:
+        issues.append(dict(location, field='options', level='error', code='poll_options_count',
+                           message=f"{len(options)} вариантов, допустимо "
+                                   f"{TELEGRAM_POLL_MIN_OPTIONS}-{TELEGRAM_POLL_MAX_OPTIONS}"))
+    for index, option in enumerate(options):
+        length = utf16_len(option.strip()) if isinstance(option, str) else 0
+        if not 1 <= length <= TELEGRAM_POLL_OPTION_LIMIT:
+            issues.append(dict(location, field=f'options[{index}]', level='error', code='poll_option_length',
+                               message=f"{length} UTF-16 символов, допустимо 1-{TELEGRAM_POLL_OPTION_LIMIT}"))
+    correct = entry.get('correct_answer')
+    if not isinstance(correct, int) or not 0 <= correct < len(options):
+        issues.append(dict(location, field='correct_answer', level='error', code='poll_correct_answer',
+                           message=f"индекс правильного ответа {correct!r} вне списка вариантов"))
+
+    if 'question' not in entry:
+        return
+    _, plain = TelegramHTMLValidator().validate(entry['question'])
+    length = utf16_len(plain.strip())
+    if length > TELEGRAM_POLL_QUESTION_LIMIT:
+        issues.append(dict(location, field='question', level='warning', code='poll_question_length',
+                           message=f"{length} UTF-16 символов > {TELEGRAM_POLL_QUESTION_LIMIT}: "
+                                   f"в sendPoll вопрос придется сократить"))
+
+
+def _lint_content_source(owner, source: str):
+    """Загрузка и проверка одного источника контента (выполняется в пуле потоков)"""
+    entries = getattr(owner, SafetyContentManager.CONTENT_SOURCES[source])()
+    return source, entries, _lint_entries(source, entries)
+
+
+def _lint_entries(source: str, entries: dict):
+    """Проверка записей одного источника (базового или слоя переопределений)"""
+    issues = []
+    for key, entry in entries.items():
+        location = {'source': source, 'key': key}
+        if isinstance(entry, dict):
+            for field in ('question', 'scenario', 'explanation'):
+                if field in entry:
+                    _lint_html_message(entry[field], dict(location, field=field), issues)
+            _lint_poll(entry, location, issues)
+        else:
+            _lint_html_message(entry, dict(location, field='text'), issues)
+    return issues
+
+
+def run_content_lint(out_dir: str):
+    """Параллельная проверка всего контента; пишет артефакт и отчет в out_dir"""
+    started = datetime.now()
+    # Экземпляр без __init__: загрузчикам не нужны ни Telegram, ни БД, ни планировщик
+    owner = SafetyContentManager.__new__(SafetyContentManager)
+    sources = list(SafetyContentManager.CONTENT_SOURCES)
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        results = list(pool.map(lambda source: _lint_content_source(owner, source), sources))
+
+    content = {source: entries for source, entries, _ in results}
+    issues = [issue for _, _, source_issues in results for issue in source_issues]
+
+    # Дополнительные пулы (CONTENT_POOLS_FILE) входят в артефакт и проверяются
+    pooled = {source: dict(entries) for source, entries in content.items()}
+    owner._extend_content_pools(pooled)
+    for source, entries in pooled.items():
+        extra = {key: entry for key, entry in entries.items() if key not in content[source]}
+        if extra:
+            issues.extend(_lint_entries(f"pool/{source}", extra))
+    content = pooled
+
+    # Региональные и деповские переопределения проверяются по тем же правилам
+    overlays = owner._load_content_overlays()
+    layers = [(f"region:{name}", layer) for name, layer in overlays['regions'].items()]
+    layers += [(f"depot:{name}", depot['content']) for name, depot in overlays['depots'].items()]
+    for layer_name, layer in layers:
+        for source, entries in layer.items():
+            issues.extend(_lint_entries(f"{layer_name}/{source}", entries))
+    serialized = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    version = hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:16]
+    errors = sum(1 for issue in issues if issue['level'] == 'error')
+
+    report = {
+        'version': version,
+        'generated_at': started.isoformat(),
+        'duration_ms': round((datetime.now() - started).total_seconds() * 1000, 1),
+        'summary': {
+            'entries': sum(len(entries) for entries in content.values()),
+            'errors': errors,
+            'warnings': len(issues) - errors
+        },
+        'issues': issues
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    if not errors:
+        # Артефакт выпускается только из полностью валидного контента
+        with open(os.path.join(out_dir, 'content.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'generated_at': report['generated_at'], 'content': content},
+                      f, ensure_ascii=False, sort_keys=True)
+    with open(os.path.join(out_dir, 'lint_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def cli_lint_content(argv):
+    """python app.py lint-content [--out-dir DIR]"""
+    parser = argparse.ArgumentParser(prog='app.py lint-content',
+                                     description='Проверка контента на лимиты и HTML-разметку Telegram')
+    parser.add_argument('--out-dir', default='build/content', help='каталог для артефакта и отчета')
+    args = parser.parse_args(argv)
+
+    report = run_content_lint(args.out_dir)
+    for issue in report['issues']:
+        print(f"{issue['level'].upper()} {issue['source']}:{issue['key']}:{issue.get('field', '')} "
+              f"[{issue['code']}] {issue['message']}")
+    summary = report['summary']
+    print(f"Проверено записей: {summary['entries']}, ошибок: {summary['errors']}, "
+          f"предупреждений: {summary['warnings']} ({report['duration_ms']} мс)")
+    return 1 if summary['errors'] else 0
+
+
+# ==================== DEBUG ====================
+
+# Один профиль за раз: выборка стеков нагружает небольшой инстанс
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.01):
+    """Выборочный профиль всех потоков процесса.
+
+    Каждые interval секунд снимаются стеки всех потоков (sys._current_frames),
+    кроме собственного. Возвращает (Counter-словарь "поток;кадр;...;кадр" -> число
+    выборок, число проходов) - формат collapsed stacks для flamegraph.pl/speedscope.
+    """
+    own_ident = threading.get_ident()
+    stacks = {}
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            # Номера потоков в именах пулов различаются, в корне стека - общее имя
+            thread_name = names.get(ident, f"thread-{ident}").rstrip('0123456789').rstrip('-_') or 'thread'
+            key = ';'.join([thread_name] + labels[::-1])
+            stacks[key] = stacks.get(key, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def deep_sizeof(obj, seen=None):
+    """Размер объекта в байтах вместе с вложенными словарями, списками и строками"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def process_rss_bytes():
+    """Резидентная память процесса (Linux /proc; иначе пиковое значение getrusage)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_report(manager, limit: int = 20):
+    """Сводка памяти: RSS, топ выделений tracemalloc и размеры структур контента.
+
+    content_rss - RSS, измеренный до и после последней сборки content_store;
+    остальные размеры контента - оценки по sys.getsizeof.
+    """
+    report = {'rss_bytes': process_rss_bytes(), 'tracemalloc': {'tracing': tracemalloc.is_tracing()}}
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        report['tracemalloc'].update(
+            current_bytes=current,
+            peak_bytes=peak,
+            top=[{
+                'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                'size_bytes': stat.size,
+                'count': stat.count
+            } for stat in snapshot.statistics('lineno')[:limit]]
+        )
+    if manager is not None and hasattr(manager, 'content_store'):
+        report['content_store'] = manager.content_store.stats()
+        report['content_rss'] = manager.content_rss
+        report['content_cache'] = {
+            'resolved_variants': len(manager._resolved_content),
+            'resolved_content_bytes': deep_sizeof(manager._resolved_content),
+            'resolved_pools_bytes': deep_sizeof(manager._resolved_pools),
+            'overlays_bytes': deep_sizeof(manager.content_overlays)
+        }
+    if manager is not None:
+        report['settings_cache'] = manager.settings.snapshot()
+    return report
+
+
+# CLI-команды: python app.py <команда> [аргументы]
+CLI_COMMANDS = {
+    'lint-content': cli_lint_content,
+    'restore-backup': cli_restore_backup,
+    'simulate': cli_simulate
+}
+
+
+def _cli_command():
+    """Команда CLI, если app.py запущен как скрипт с ее именем"""
+    if __name__ == '__main__' and len(sys.argv) > 1:
+        return CLI_COMMANDS.get(sys.argv[1])
+    return None
+
+
+# Глобальный экземпляр (CLI-команды не запускают планировщик и не обращаются к Telegram)
+safety_manager = None if _cli_command() else SafetyContentManager()
 
 # ==================== FLASK ROUTES ====================
 
+@app.context_processor
+def inject_breaker_status():
+    """Состояние Telegram API для карточки дашборда во всех шаблонах"""
+    breaker = getattr(safety_manager, 'telegram_breaker', None)
+    if breaker is None:
+        return {}
+    return {
+        'breaker_state': breaker.state,
+        'breaker_trips': breaker.trips,
+        'outbound_pending': safety_manager.outbound_pending()
+    }
+
+@app.context_processor
+def inject_channel_audit():
+    """Таблица последних проверок каналов для дашборда"""
+    if not hasattr(safety_manager, 'audit_concurrency') or not safety_manager.bot_token:
+        return {}
+    return {'channel_audit': safety_manager.get_channel_audit()}
+
 @app.route('/')
 def dashboard():
     """Главный дашборд"""
@@ -1522,7 +4958,18 @@ def send_manual():
         )
     
     try:
-        result = asyncio.run(safety_manager.send_manual_post(post_type, content_day, custom_text))
+        send_at = request.form.get('send_at')
+        if post_type == 'custom' and send_at:
+            post_id = safety_manager.schedule_custom_post(
+                custom_text,
+                _parse_target_time(send_at),
+                recurrence=request.form.get('recurrence') or None
+            )
+            result = f"✅ Пост #{post_id} запланирован на {send_at.replace('T', ' ')}"
+        else:
+            _, result = safety_manager.runtime.run(safety_manager.send_manual_post(
+                post_type, content_day, custom_text, urgent=bool(request.form.get('urgent'))
+            ))
         
         return render_template_string(DASHBOARD_HTML,
             bot_status=getattr(safety_manager, 'bot_status', 'error'),
@@ -1553,7 +5000,8 @@ def send_manual():
 def next_day():
     """Переход к следующему дню"""
     try:
-        new_day = safety_manager.set_next_day()
+        expected_day = request.args.get('from', type=int)
+        new_day, changed = safety_manager.set_next_day(expected_day)
         return render_template_string(DASHBOARD_HTML,
             bot_status=getattr(safety_manager, 'bot_status', 'error'),
             channel_status=getattr(safety_manager, 'channel_status', 'Не проверен'),
@@ -1562,8 +5010,8 @@ def next_day():
             current_day=new_day,
             scheduled_jobs=safety_manager.get_scheduled_jobs(),
             recent_logs=safety_manager.get_stats()['recent_logs'],
-            message=f"✅ Перешли к дню {new_day}",
-            message_type="success"
+            message=f"✅ Перешли к дню {new_day}" if changed else f"ℹ️ День уже сменился: сейчас день {new_day}",
+            message_type="success" if changed else "warning"
         )
     except Exception as e:
         return render_template_string(DASHBOARD_HTML,
@@ -1580,42 +5028,302 @@ def next_day():
 
 @app.route('/send-daily')
 def send_daily():
-    """Отправка всех постов текущего дня"""
+    """Отправка всех постов текущего дня (фоновое задание)"""
     try:
-        results = []
         post_types = ['daily_rule', 'safety_number', 'tech_training', 'incident_analysis', 'psychology']
         current_day = safety_manager.get_current_day()
-        
-        for post_type in post_types:
-            result = asyncio.run(safety_manager.send_manual_post(post_type, current_day))
-            results.append(f"{post_type}: {result}")
-            import time
-            time.sleep(2)
-        
-        return render_template_string(DASHBOARD_HTML,
-            bot_status=getattr(safety_manager, 'bot_status', 'error'),
-            channel_status=getattr(safety_manager, 'channel_status', 'Не проверен'),
-            jobs_count=len(safety_manager.get_scheduled_jobs()),
-            posts_sent=safety_manager.get_stats()['posts_sent'],
-            current_day=current_day,
-            scheduled_jobs=safety_manager.get_scheduled_jobs(),
-            recent_logs=safety_manager.get_stats()['recent_logs'],
-            message=f"✅ Все посты дня {current_day} отправлены!\n" + "\n".join(results),
-            message_type="success"
+        job_id = safety_manager.jobs.start(
+            lambda post: safety_manager.send_manual_post(post['post_type'], post['day']),
+            [{'post_type': post_type, 'day': current_day} for post_type in post_types],
+            name=f"Все посты дня {current_day}"
         )
-            
+        message = f"✅ Отправка постов дня {current_day} запущена в фоне. Ход выполнения: /jobs/{job_id}"
+        message_type = "success"
     except Exception as e:
-        return render_template_string(DASHBOARD_HTML,
-            bot_status=getattr(safety_manager, 'bot_status', 'error'),
-            channel_status=getattr(safety_manager, 'channel_status', 'Не проверен'),
-            jobs_count=len(safety_manager.get_scheduled_jobs()),
-            posts_sent=safety_manager.get_stats()['posts_sent'],
-            current_day=safety_manager.get_current_day(),
-            scheduled_jobs=safety_manager.get_scheduled_jobs(),
-            recent_logs=safety_manager.get_stats()['recent_logs'],
-            message=f"❌ Ошибка: {str(e)}",
-            message_type="danger"
+        message = f"❌ Ошибка: {str(e)}"
+        message_type = "danger"
+
+    return render_template_string(DASHBOARD_HTML,
+        bot_status=getattr(safety_manager, 'bot_status', 'error'),
+        channel_status=getattr(safety_manager, 'channel_status', 'Не проверен'),
+        jobs_count=len(safety_manager.get_scheduled_jobs()),
+        posts_sent=safety_manager.get_stats()['posts_sent'],
+        current_day=safety_manager.get_current_day(),
+        scheduled_jobs=safety_manager.get_scheduled_jobs(),
+        recent_logs=safety_manager.get_stats()['recent_logs'],
+        message=message,
+        message_type=message_type
+    )
+
+@app.route('/api/stats')
+def api_stats():
+    """Статистика публикаций за период: ?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=day,post_type"""
+    today = datetime.now(safety_manager.target_tz).date()
+    date_to = request.args.get('to', today.isoformat())
+    date_from = request.args.get('from', (today - timedelta(days=6)).isoformat())
+    group_by = [key.strip() for key in request.args.get('group_by', 'day').split(',') if key.strip()]
+    try:
+        for value in (date_from, date_to):
+            datetime.strptime(value, '%Y-%m-%d')
+        return jsonify(safety_manager.query_stats(date_from, date_to, group_by))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def _export_csv(rows):
+    """CSV-строки выгрузки по мере чтения из БД"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=SafetyContentManager.EXPORT_COLUMNS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_ndjson(rows):
+    """NDJSON: одна запись журнала на строку"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+def _gzip_stream(chunks):
+    """Потоковое gzip-сжатие без накопления всего файла в памяти"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/export/logs')
+def export_logs():
+    """Выгрузка журнала публикаций: ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&gzip=1"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    try:
+        for value in filter(None, (date_from, date_to)):
+            datetime.strptime(value, '%Y-%m-%d')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = safety_manager.iter_posting_logs(date_from, date_to)
+    chunks = _export_csv(rows) if export_format == 'csv' else _export_ndjson(rows)
+    filename = f"posting_logs_{date_from or 'start'}_{date_to or 'now'}.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = _gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/api/backups')
+def api_backups():
+    """Метрики резервного копирования и список снимков"""
+    return jsonify(dict(
+        safety_manager.backup_metrics,
+        snapshots=[{'path': path, 'size_bytes': os.path.getsize(path)}
+                   for path in list_backups(safety_manager.backup_dir)]
+    ))
+
+@app.route('/corrections', methods=['POST'])
+def start_correction():
+    """Массовое исправление или удаление поста во всех каналах (фоновое задание).
+
+    Параметры (form или JSON): post_type, day, action=edit|delete, text (необязательно),
+    channels (необязательно, через запятую), sent_after (ISO, необязательно) - по умолчанию
+    исправляется только последняя отправка в каждый канал.
+    """
+    params = request.get_json(silent=True) or request.form
+    if not params.get('post_type') or not params.get('day'):
+        return jsonify({"error": "post_type и day обязательны"}), 400
+    try:
+        channels = params.get('channels')
+        if isinstance(channels, str):
+            channels = [channel.strip() for channel in channels.split(',') if channel.strip()]
+        job_id, total = safety_manager.start_correction(
+            params.get('post_type'),
+            int(params.get('day')),
+            params.get('action', 'edit'),
+            text=params.get('text') or None,
+            channels=channels or None,
+            sent_after=_parse_target_time(params['sent_after']) if params.get('sent_after') else None
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"job_id": job_id, "messages": total, "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route('/api/content/layers')
+def content_layers():
+    """Версия контента и слои переопределений по каналам"""
+    return jsonify({
+        "version": safety_manager.content_version,
+        "channels": {
+            channel: {"region": region, "depot": depot}
+            for channel, (region, depot) in safety_manager._channel_layers.items() if channel
+        },
+        "resolved_variants": len(safety_manager._resolved_content)
+    })
+
+@app.route('/api/content/reload', methods=['POST'])
+def content_reload():
+    """Перечитать CONTENT_OVERLAYS_FILE и сбросить кеш разрешенного контента"""
+    try:
+        return jsonify({"version": safety_manager.reload_content()})
+    except (OSError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/schedule')
+def api_schedule():
+    """План публикаций: ?days=N (1-90)&channel=@канал"""
+    try:
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    if not 1 <= days <= 90:
+        return jsonify({"error": "days must be between 1 and 90"}), 400
+    channel = request.args.get('channel')
+    return jsonify(safety_manager.preview_schedule(days, [channel] if channel else None))
+
+def _parse_target_time(value):
+    """ISO-время из формы/запроса; без часового пояса - время TARGET_TIMEZONE"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = safety_manager.target_tz.localize(moment)
+    return moment
+
+@app.route('/api/custom-posts', methods=['GET', 'POST'])
+def custom_posts():
+    """Отложенные произвольные посты.
+
+    GET ?status=pending - список; POST (form или JSON): text, send_at (ISO, по умолчанию
+    время TARGET_TIMEZONE), recurrence=daily|weekly, until (ISO), channels (через запятую).
+    """
+    if request.method == 'GET':
+        return jsonify(safety_manager.list_custom_posts(request.args.get('status')))
+
+    params = request.get_json(silent=True) or request.form
+    if not params.get('text') or not params.get('send_at'):
+        return jsonify({"error": "text и send_at обязательны"}), 400
+    try:
+        channels = params.get('channels')
+        if isinstance(channels, str):
+            channels = [channel.strip() for channel in channels.split(',') if channel.strip()]
+        post_id = safety_manager.schedule_custom_post(
+            params.get('text'),
+            _parse_target_time(params.get('send_at')),
+            recurrence=params.get('recurrence') or None,
+            channels=channels or None,
+            ends_at=_parse_target_time(params.get('until')) if params.get('until') else None
         )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"id": post_id}), 201
+
+@app.route('/api/custom-posts/<int:post_id>', methods=['DELETE'])
+def cancel_custom_post(post_id):
+    """Отмена запланированного произвольного поста"""
+    if not safety_manager.cancel_custom_post(post_id):
+        return jsonify({"error": "post not found or not pending"}), 404
+    return jsonify({"id": post_id, "status": "cancelled"})
+
+@app.route('/api/traces/<trace_id>')
+def trace_spans(trace_id):
+    """Спаны трассы публикации (trace_id из posting_logs) по времени начала"""
+    if not tracer.enabled:
+        return jsonify({"error": "трассировка отключена (TRACE_FILE пуст)"}), 404
+    spans = tracer.find(trace_id)
+    if not spans:
+        return jsonify({"error": "trace not found"}), 404
+    return jsonify({"trace_id": trace_id, "spans": spans})
+
+def _debug_authorized():
+    """Доступ к /debug/*: заголовок X-Debug-Token совпадает с DEBUG_TOKEN.
+
+    Только заголовок: строка запроса попадает в журнал доступа gunicorn.
+    """
+    expected = os.getenv('DEBUG_TOKEN')
+    provided = request.headers.get('X-Debug-Token', '')
+    return bool(expected) and hmac.compare_digest(provided.encode(), expected.encode())
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Выборочный профиль всех потоков: ?seconds=N (1-60)&interval=мс. Ответ - collapsed stacks"""
+    if not _debug_authorized():
+        return jsonify({"error": "not found"}), 404
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 10)) / 1000
+    except ValueError:
+        return jsonify({"error": "seconds и interval должны быть числами"}), 400
+    if not 1 <= seconds <= 60 or not 0.001 <= interval <= 1:
+        return jsonify({"error": "seconds: 1-60, interval: 1-1000 мс"}), 400
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({"error": "профилирование уже выполняется"}), 409
+    try:
+        stacks, samples = sample_stacks(seconds, interval)
+    finally:
+        _profile_lock.release()
+
+    body = ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    return Response(body, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Profile-Samples': str(samples)
+    })
+
+@app.route('/debug/memory')
+def debug_memory():
+    """Память процесса: ?tracemalloc=start|stop&limit=N; размеры структур контента"""
+    if not _debug_authorized():
+        return jsonify({"error": "not found"}), 404
+    action = request.args.get('tracemalloc')
+    if action == 'start' and not tracemalloc.is_tracing():
+        tracemalloc.start(int(os.getenv('TRACEMALLOC_FRAMES', '1')))
+    elif action == 'stop' and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify(memory_report(safety_manager, limit))
+
+@app.route('/events')
+def dashboard_event_stream():
+    """Поток изменений дашборда (Server-Sent Events)"""
+    events = safety_manager.dashboard_events
+    subscriber = events.subscribe()
+    if subscriber is None:
+        return jsonify({"error": "too many event stream clients"}), 503, {'Retry-After': '30'}
+    response = Response(
+        stream_with_context(events.stream(subscriber)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Генератор, так и не начавший работу, не выполнит свой finally
+    response.call_on_close(lambda: events.unsubscribe(subscriber))
+    return response
+
+@app.route('/jobs')
+def list_jobs():
+    """Список фоновых заданий"""
+    return jsonify(safety_manager.jobs.list())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Ход выполнения фонового задания"""
+    job = safety_manager.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
 
 @app.route('/start-scheduler')
 def start_scheduler():
@@ -1650,6 +5358,9 @@ def stop_scheduler():
         if safety_manager.stop_scheduler():
             message = "✅ Планировщик остановлен"
             message_type = "success"
+        elif safety_manager.scheduler_running_elsewhere():
+            message = "⚠️ Планировщик работает в другом процессе (воркере), остановите его там"
+            message_type = "warning"
         else:
             message = "⚠️ Планировщик уже остановлен"
             message_type = "warning"
@@ -1673,7 +5384,7 @@ def stop_scheduler():
 def test_connection():
     """Тестирование подключения к каналу"""
     try:
-        result = asyncio.run(safety_manager.test_channel_connection())
+        result = safety_manager.runtime.run(safety_manager.test_channel_connection())
         if result:
             message = "✅ Подключение к каналу успешно"
             message_type = "success"
@@ -1696,12 +5407,53 @@ def test_connection():
         message_type=message_type
     )
 
+@app.route('/audit-channels')
+def audit_channels():
+    """Проверка доступа и прав бота во всех каналах"""
+    try:
+        records = safety_manager.runtime.run(safety_manager.audit_channels())
+        failed = [record for record in records if record['status'] == 'fail']
+        if failed:
+            message = f"❌ Недоступно {len(failed)} из {len(records)} каналов: {failed[0]['channel']} - {failed[0]['error']}"
+            message_type = "danger"
+        else:
+            message = f"✅ Проверено каналов: {len(records)}"
+            message_type = "success"
+    except Exception as e:
+        message = f"❌ Ошибка проверки: {str(e)}"
+        message_type = "danger"
+
+    return render_template_string(DASHBOARD_HTML,
+        bot_status=getattr(safety_manager, 'bot_status', 'error'),
+        channel_status=getattr(safety_manager, 'channel_status', 'Не проверен'),
+        jobs_count=len(safety_manager.get_scheduled_jobs()),
+        posts_sent=safety_manager.get_stats()['posts_sent'],
+        current_day=safety_manager.get_current_day(),
+        scheduled_jobs=safety_manager.get_scheduled_jobs(),
+        recent_logs=safety_manager.get_stats()['recent_logs'],
+        message=message,
+        message_type=message_type
+    )
+
+@app.route('/api/channels', methods=['GET', 'POST'])
+def api_channels():
+    """Последняя проверка каналов (GET) или новая проверка (POST, channels=@a,@b)"""
+    if request.method == 'GET':
+        return jsonify({'channels': safety_manager.get_channel_audit()})
+    channels = [channel.strip() for channel in (request.values.get('channels') or '').split(',') if channel.strip()]
+    unknown = set(channels) - set(safety_manager.channel_ids)
+    if unknown:
+        return jsonify({'error': f"Неизвестные каналы: {', '.join(sorted(unknown))}"}), 400
+    started = time.monotonic()
+    records = safety_manager.runtime.run(safety_manager.audit_channels(channels or None))
+    return jsonify({'channels': records, 'duration_ms': round((time.monotonic() - started) * 1000, 1)})
+
 @app.route('/send-test')
 def send_test():
     """Отправка тестового сообщения"""
     try:
         test_message = "🧪 <b>ТЕСТОВОЕ СООБЩЕНИЕ</b>\n\nЭто тестовое сообщение для проверки работы бота безопасности.\n\n✅ Система работает нормально!"
-        success, result = asyncio.run(safety_manager.send_telegram_message(test_message))
+        success, result, _ = safety_manager.runtime.run(safety_manager.send_telegram_message(test_message))
         
         if success:
             message = "✅ Тестовое сообщение отправлено"
@@ -1729,7 +5481,7 @@ def send_test():
 def clear_logs():
     """Очистка логов"""
     try:
-        conn = sqlite3.connect('safety_bot.db', check_same_thread=False)
+        conn = sqlite3.connect(safety_manager.db_path, check_same_thread=False)
         cursor = conn.cursor()
         cursor.execute('DELETE FROM posting_logs')
         conn.commit()
@@ -1755,8 +5507,20 @@ def clear_logs():
 
 @app.route('/health')
 def health():
-    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+    """Состояние компонентов из кеша фоновых проверок (без сетевых запросов)"""
+    snapshot = safety_manager.health.snapshot()
+    return jsonify(dict(snapshot, timestamp=datetime.now().isoformat()))
+
+@app.route('/ready')
+def ready():
+    """Готовность принимать трафик: 503, если критичный компонент неисправен"""
+    snapshot = safety_manager.health.snapshot()
+    is_ready = snapshot['status'] in ('healthy', 'degraded') and not snapshot['stale']
+    return jsonify(dict(snapshot, ready=is_ready)), 200 if is_ready else 503
 
 if __name__ == '__main__':
+    if _cli_command():
+        sys.exit(_cli_command()(sys.argv[2:]))
+
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=os.environ.get('DEBUG_MODE', False))
@@ -0,0 +1,14 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# Один воркер: задания /jobs, circuit breaker, SSE и состояние проверок
+# здоровья хранятся в памяти процесса. Параллелизм дают потоки
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+# Потоки воркера только ждут результата в общем цикле событий процесса
+# (AsyncRuntime), поэтому их может быть много
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+keepalive = 5
+accesslog = '-'